@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compiles each song folder of MP3 tracks into one pack of 16 bit PCM, already turned down
+by the playback volume reduction, so boxes can play a song without decoding it.
+Usage: python compile_tracks.py [tracks folder] [packs folder]
+"""
+
+import os
+import sys
+import struct
+from pydub import AudioSegment
+
+# mirrors main_protocol.py
+AUDIO_PATH = "tracks/"  # folder of song folders
+PACK_PATH = "packs/"  # folder of compiled songs, one pack per song folder
+REDUCE_VOLUME = 5  # reduce volume of track
+PACK_MAGIC = b"SBPK"
+PACK_VERSION = 1
+PRIORITY_FILE = "priority.txt"  # track order of a song, not a track
+PACK_HEADER = struct.Struct("<4sHHIHHf")  # magic, version, tracks, frame rate, channels, sample width, gain
+PACK_ENTRY = struct.Struct("<64sQQ")  # track file name, byte offset of samples, byte length
+
+
+def compile_song(song_path, pack_path, gain=REDUCE_VOLUME):
+    """
+    Decodes every track of a song and writes them into one pack.
+    :param song_path: folder of song's MP3 tracks.
+    :param pack_path: pack file to write.
+    :param gain: dB tracks are turned down by.
+    :return: number of tracks packed.
+    """
+
+    track_names = sorted(n for n in os.listdir(song_path) if n != PRIORITY_FILE)
+    sounds = []
+    for track_name in track_names:
+        sound = AudioSegment.from_file(os.path.join(song_path, track_name), format="mp3")
+        sound = sound.set_sample_width(2)
+        sound = sound - gain
+        if len(sounds) > 0:  # one format per pack, taken from first track
+            sound = sound.set_frame_rate(sounds[0].frame_rate).set_channels(sounds[0].channels)
+        sounds.append(sound)
+
+    if len(sounds) == 0:
+        return 0
+
+    # index right after header, samples after index
+    offset = PACK_HEADER.size + PACK_ENTRY.size * len(sounds)
+    entries = []
+    for track_name, sound in zip(track_names, sounds):
+        entries.append(PACK_ENTRY.pack(track_name.encode(), offset, len(sound.raw_data)))
+        offset += len(sound.raw_data)
+
+    # write next to old pack and swap in, a box never sees half a pack
+    tmp_path = pack_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(sounds), sounds[0].frame_rate,
+                                 sounds[0].channels, sounds[0].sample_width, gain))
+        for entry in entries:
+            f.write(entry)
+        for sound in sounds:
+            f.write(sound.raw_data)
+    os.replace(tmp_path, pack_path)
+    return len(sounds)
+
+
+def main():
+    audio_path = sys.argv[1] if len(sys.argv) > 1 else AUDIO_PATH
+    pack_path = sys.argv[2] if len(sys.argv) > 2 else PACK_PATH
+    os.makedirs(pack_path, exist_ok=True)
+
+    for song in sorted(os.listdir(audio_path)):
+        song_path = os.path.join(audio_path, song)
+        if not os.path.isdir(song_path):
+            continue
+        num_tracks = compile_song(song_path, os.path.join(pack_path, song + ".pack"))
+        print(f"Packed {num_tracks} tracks of {song}")
+
+
+if __name__ == "__main__":
+    main()
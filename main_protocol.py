@@ -2,20 +2,32 @@ import cc1101
 import time
 import sys, os
 import random
+import zlib
+import json
+import threading
+import mmap
+import struct
+import subprocess
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Button
 from datetime import timedelta
 from uuid import getnode
 from enum import Enum
-from math import ceil
+from math import ceil, sqrt
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 from pydub import AudioSegment
 from pydub.playback import _play_with_simpleaudio, play
+from pydub.utils import mediainfo
 
 """ Constants used in transceiver functions. """
 RAND_LOWER = 0.05  # must be > 0 or else TX error thrown
 RAND_UPPER = 0.5
-WAIT_FOR_ATTENDANCE_SEC = 2  # new device on startup
+WAIT_FOR_ATTENDANCE_SEC = 2  # new device on startup, also length of discovery phase
+PROBE_JITTER_SEC = 0.6  # maximum gap between a booting device's discovery probes
+CLAIM_ROUND_SEC = 2  # devices that think they won discovery keep probing this long, yielding to a higher one
 ATTENDANCE_RESPONSE_SEC = 1.5  # send duration for follower responses
 SEND_LIST_DELAY = 0.1  # between sending list messages on leader side
 WAIT_FOR_CHECK_IN_RESPONSE = 1.5  # leader waiting for response from device
@@ -24,6 +36,57 @@ CHECK_IN_DELAY = 0.5  # leader delay between different check in messages
 FOLLOWER_LISTEN_THRESHOLD = 4  # how long follower waits until entering leader takeover stage
 SINGLE_SEND_DURATION = 0.5  # baseline send duration
 MAX_MISSED_CHECK_INS = 2  # acommodates packet loss or noisy channel
+CONTROL_FREQUENCY_HZ = 433.92e6  # every device starts out and listens here
+SYMBOL_RATES_BAUD = [4800, 9600, 19200, 38400]  # first rate is used on startup and for attendance
+RATE_ADAPTATION = False  # leader raises symbol rate while every link is good
+RATE_UP_RSSI_DBM = -70  # weakest link needed to leave the base rate
+RATE_STEP_DB = 5  # extra signal needed for each further rate step
+RATE_MAX_LQI = 30  # worst link quality indicator allowed for stepping up, lower is better
+RATE_ERROR_LIMIT = 0.2  # fraction of bad or missed frames that makes leader step down
+RATE_HOLD_SEC = 30  # minimum time between steps up
+RATE_FALLBACK_SEC = 14  # follower drops to base rate after this much silence, outlasts attendance and a song load
+LINK_WEIGHT = 0.3  # weight of newest measurement in a link's running average
+MAX_CHECK_IN_INTERVAL = 20  # upper bound in seconds between check-ins with any one follower
+CHECK_IN_RISK_WEIGHT = 0.5  # weight of the latest check-in result in a device's risk score
+CHECK_IN_RISK_THRESHOLD = 0.2  # devices at or above this risk are checked in every cycle
+LEASE_RENEW_GAP_SEC = max(SINGLE_SEND_DURATION + RAND_UPPER, WAIT_FOR_CHECK_IN_RESPONSE)  # longest leader stretch between lease renewals, a request burst or a response window
+LEASE_PERIOD_SEC = 2 * LEASE_RENEW_GAP_SEC  # standby leader takes over if its lease is not renewed in this time, outlasts one lost renewal, shorter than FOLLOWER_LISTEN_THRESHOLD
+SONG_LOAD_LEASE_SEC = 10  # longer lease granted before leader blocks on loading a song
+EPOCH_MODULUS = 128  # membership epochs wrap around, fits in the upper option bits
+GOSSIP_MODE = False  # followers spread membership among themselves instead of relying on leader
+GOSSIP_PULL_INTERVAL = 5  # minimum seconds between a follower's pull requests
+GOSSIP_PULL_TIMEOUT = 8  # how long a pull waits for peer's list before giving up
+MULTI_CHANNEL_MODE = False  # followers answer check-ins on separate data channels
+DATA_FREQUENCIES_HZ = [433.42e6, 434.42e6, 433.17e6, 434.67e6]  # inside 433.05-434.79 MHz band
+CHANNEL_DWELL_SEC = 0.15  # how long leader listens on one data channel before hopping
+DEPUTY_MODE = False  # leader hands check-ins of most followers to a few deputies
+MAX_DEPUTIES = 3  # leader's own check-in load stays near this many devices
+DEPUTY_MIN_FOLLOWERS = 8  # deputies are only appointed for ensembles at least this large
+DEPUTY_TICK_SEC = 0.5  # deputy wakes up at least this often to check in with its group
+DEPUTY_REPORT_INTERVAL = 3  # seconds between deputy's reports of the same failures
+RELAY_MODE = False  # followers forward leader messages to boxes out of leader's range
+MAX_HOPS = 3  # relayed messages are dropped after this many hops
+RELAY_RSSI_DBM = -80  # only boxes hearing the leader this weakly start relaying its messages
+RELAY_DUPLICATE_SEC = 3  # identical messages within this window are duplicates
+RELAY_AGGREGATE_SEC = 0.3  # relay collects replies this long before forwarding them together
+STATE_PATH = "device_state.json"  # role and membership saved for warm restart after a reboot
+STATE_SAVE_INTERVAL_SEC = 30  # saved state is refreshed at least this often, well within STATE_MAX_AGE_SEC
+STATE_SAVE_KEYS = ("leader_address", "track", "epoch", "succession", "devices", "song_folder_idx")  # saved at once when changed
+STATE_MAX_AGE_SEC = 60  # older saved state is ignored on reboot, device joins from scratch
+REJOIN_WAIT_SEC = 4  # how long a rebooted follower asks its old leader to take it back
+PRIORITY_FILE = "priority.txt"  # in a song folder, track file names one per line, most important first
+STEM_PRIORITY_KEYWORDS = ["vocal", "melody", "lead", "bass", "drum", "chord", "harmony", "pad"]  # fallback, most important first
+SUITABILITY_UPTIME_SEC = 60  # devices connected this long count as fully settled for track assignment
+SNAPSHOT_WAIT_SEC = 4  # joiner asks leader for a snapshot if none completes this long after joining
+SNAPSHOT_NO_RANK = 0xFE  # rank of snapshot entries missing from succession, such as the leader
+SUCCESSION_REMOVED = 0  # succession entry of a deleted device, ranks not heard yet are None instead
+SUCCESSION_REPEAT_SEC = 30  # leader resends an unchanged succession list this often, fills ranks followers missed
+TIME_SYNC_INTERVAL_SEC = 5  # follower's time between clock sync round trips once synced
+TIME_SYNC_FAST_SEC = 1  # interval while follower collects its first samples
+TIME_SYNC_SAMPLES = 8  # recent round trips kept for filtering
+TIME_SYNC_MIN_SAMPLES = 3  # round trips needed before leader times are converted
+TIME_SYNC_TIMEOUT = 1  # replies later than this are dropped, queueing makes them inaccurate
+TIME_SYNC_DRIFT_SPAN_SEC = 20  # samples must cover this long before drift is estimated
 
 looping = True
 
@@ -52,6 +115,32 @@ FOLLOW_IMG[:, :, :] = (0, 0, 0xFF)
 # audio information
 AUDIO_PATH = "tracks/"  # folder of song folders
 REDUCE_VOLUME = 5  # reduce volume of track
+TRACK_CACHE_BYTES = 256 * 1024 * 1024  # decoded tracks kept in memory, least recently used dropped first
+PACK_PATH = "packs/"  # songs compiled by compile_tracks.py, played instead of decoding MP3s
+PACK_MAGIC = b"SBPK"
+PACK_VERSION = 1
+PACK_HEADER = struct.Struct("<4sHHIHHf")  # magic, version, tracks, frame rate, channels, sample width, gain
+PACK_ENTRY = struct.Struct("<64sQQ")  # track file name, byte offset of samples, byte length
+CATALOG_CHECK_SEC = 10  # how often song catalog checks tracks folder for changes
+SONG_MAX_SEC = None  # leader only picks songs up to this long, None for any length
+PREFETCH_WORKERS = 2  # background threads decoding tracks a device may be asked to play
+RESERVE_PREFETCH_TRACKS = 2  # reserves decode this many of the most important tracks devices hold, others stream when promoted
+STREAM_CHUNK_SEC = 2  # audio decoded at a time when a track is streamed instead of decoded whole
+STREAM_FRAME_RATE = 44100  # format streamed tracks are decoded to
+STREAM_CHANNELS = 2
+START_SPIN_SEC = 0.0004  # scheduler sleeps until this close to a start time, then spins
+DRIFT_CORRECTION = False  # decoded tracks also play in chunks so beacons can correct them finely, at the cost of a seam per chunk
+DRIFT_RESTART_SEC = 0.015  # track playing in one piece restarts at leader's position when this far from it
+BEACON_INTERVAL_SEC = 2  # time between leader's playback beacons
+STREAM_CORRECT_SEC = 0.05  # chunk is adjusted this long before it is due to start
+DRIFT_DEADBAND_SEC = 0.001  # smaller differences from leader's playback are left alone
+DRIFT_STEP_SEC = 0.02  # larger differences are closed at once by dropping samples or waiting
+DRIFT_MAX_STRETCH = 0.002  # most a chunk is stretched or squeezed by, inaudible as a change in pitch
+MIX_UNASSIGNED = True  # tracks no device is assigned are mixed into assigned devices' tracks
+MIX_LOW_WEIGHT = 0.5  # weight of least important track in a mix, more important tracks closer to 1
+NEXT_SONG_LOOKAHEAD_SEC = 20  # leader announces next song this long before current one ends
+NEXT_SONG_REPEAT_SEC = 4  # announcement is repeated this often until next song starts
+NEXT_SONG_PREPARE_SEC = 1  # devices pick their track and ready its first chunk this long before next song
 SONG_START_OFFSET = 2  # baseline delay for song start in seconds
 
 
@@ -67,6 +156,43 @@ class ActionCodes(Enum):
     DELETE = 0b0110
     NEW_LEADER = 0b1111
     SONG_JOIN = 0b1100
+    LEASE = 0b0111
+    SUCCESSION = 0b1001
+    MERGE = 0b1010
+    GOSSIP_PULL = 0b1011
+    CHANNEL = 0b1101
+    DEPUTY = 0b1110
+    REPORT = 0b10000
+    RATE = 0b10001
+    PROBE = 0b10010
+    REJOIN = 0b10011
+    SNAPSHOT_REQUEST = 0b10100
+    SNAPSHOT = 0b10101
+    SNAPSHOT_ENTRY = 0b10110
+    SNAPSHOT_END = 0b10111
+    TIME_SYNC = 0b11000
+    TIME_SYNC_REPLY = 0b11001
+    BEACON = 0b11010
+    NEXT_SONG = 0b11011
+
+
+# leader messages that relays forward away from leader, replies travel back the other way
+RELAYED_ACTIONS = {
+    ActionCodes.ATTENDANCE.value,
+    ActionCodes.SONG.value,
+    ActionCodes.SONG_JOIN.value,
+    ActionCodes.N_LIST.value,
+    ActionCodes.DELETE.value,
+    ActionCodes.CHECK_IN.value,
+    ActionCodes.LEASE.value,
+    ActionCodes.SUCCESSION.value,
+    ActionCodes.SNAPSHOT.value,
+    ActionCodes.SNAPSHOT_ENTRY.value,
+    ActionCodes.SNAPSHOT_END.value,
+    ActionCodes.BEACON.value,
+    ActionCodes.NEXT_SONG.value,
+}
+REPLY_ACTIONS = {ActionCodes.RESPONSE.value, ActionCodes.REPORT.value, ActionCodes.SNAPSHOT_REQUEST.value}
 
 
 class MessageBits(Enum):
@@ -76,9 +202,9 @@ class MessageBits(Enum):
     # 9223372036854775807 is max 48 bit integer
     # 65535 is max 16 bit integer
 
-    ACTION_LEN = 4
+    ACTION_LEN = 8
     ACTION_SHIFT = 0
-    ACTION_MASK = 0xF << ACTION_SHIFT
+    ACTION_MASK = 0xFF << ACTION_SHIFT
     FOLLOW_ADDR_LEN = 48
     FOLLOW_ADDR_SHIFT = ACTION_SHIFT + ACTION_LEN
     FOLLOW_ADDR_MASK = 0xFFFFFFFFFFFF << FOLLOW_ADDR_SHIFT
@@ -88,6 +214,10 @@ class MessageBits(Enum):
     OPTION_LEN = 16
     OPTION_SHIFT = LEADER_ADDR_SHIFT + LEADER_ADDR_LEN
     OPTION_MASK = 0xFFFF << OPTION_SHIFT
+    # hop count is 0 unless relayed, so it adds no length to direct messages
+    HOP_LEN = 4
+    HOP_SHIFT = OPTION_SHIFT + OPTION_LEN
+    HOP_MASK = 0xF << HOP_SHIFT
 
 
 class Message:
@@ -111,6 +241,10 @@ class Message:
         self.options = self.bit_masking(
             msg, MessageBits.OPTION_MASK, MessageBits.OPTION_SHIFT
         )
+        self.hops = self.bit_masking(
+            msg, MessageBits.HOP_MASK, MessageBits.HOP_SHIFT
+        )
+        self.key = msg & ~MessageBits.HOP_MASK.value  # same for every copy of a relayed message
 
         # negatives are transmitted as two's complement
         if self.options == (1 << MessageBits.OPTION_LEN.value) - 1:
@@ -137,6 +271,7 @@ class Message:
             f"Leader Address: {hex(self.leader_addr)}",
             f"Follower Address: {hex(self.follow_addr)}",
             f"Options: {self.options}",
+            f"Hops: {self.hops}",
         ]
         return "\n\t".join(out)
 
@@ -144,6 +279,9 @@ class Message:
 class Device:
     """ Lightweight device object for storing in a DeviceList. """
 
+    __slots__ = ("address", "track", "leader", "received", "missed", "risk",
+                 "last_check_in", "channel", "rssi", "lqi", "joined")
+
     def __init__(self, address):
         """
         Non-default constructor for Device object.
@@ -155,6 +293,12 @@ class Device:
         self.leader = False  # initialized as follower
         self.received = None
         self.missed = 0  # used by current leader
+        self.risk = 1.0  # likelihood of missing a check-in, new devices start as risky
+        self.last_check_in = None  # time of leader's last check-in with this device
+        self.channel = None  # data channel index for check-in responses, None for control
+        self.rssi = None  # running average of signal strength heard from device in dBm
+        self.lqi = None  # running average of link quality indicator, lower is better
+        self.joined = time.time()  # time device was first heard
 
     def get_leader(self):
         """
@@ -179,11 +323,50 @@ class Device:
 
     def set_track(self, track):
         """
-        :param track: index assigned to Device.
+        :param track: index assigned to Device, use DeviceList.update_track once Device is listed.
         """
 
         self.track = track
 
+    def record_link(self, rssi, lqi):
+        """
+        Updates link quality averages after hearing from device.
+        :param rssi: signal strength of message in dBm.
+        :param lqi: link quality indicator of message.
+        """
+
+        if self.rssi is None:
+            self.rssi, self.lqi = rssi, lqi
+        else:
+            self.rssi += LINK_WEIGHT * (rssi - self.rssi)
+            self.lqi += LINK_WEIGHT * (lqi - self.lqi)
+
+    def suitability(self, now):
+        """
+        How well device can be trusted with an important track, used by leader.
+        :param now: current time.
+        :return: score from uptime and link quality, less risk of missing check-ins.
+        """
+
+        uptime = min((now - self.joined) / SUITABILITY_UPTIME_SEC, 1)
+        link = 0 if self.rssi is None else min(max((self.rssi - RELAY_RSSI_DBM) / (RATE_UP_RSSI_DBM - RELAY_RSSI_DBM), 0), 1)
+        return uptime + link - self.risk
+
+    def record_check_in(self, responded, check_in_time):
+        """
+        Updates missed count and risk score after a check-in.
+        :param responded: True if device responded to check-in.
+        :param check_in_time: time check-in was sent.
+        """
+
+        self.last_check_in = check_in_time
+        self.risk *= 1 - CHECK_IN_RISK_WEIGHT  # older results fade out
+        if responded:
+            self.missed = 0
+        else:
+            self.missed += 1
+            self.risk += CHECK_IN_RISK_WEIGHT
+
 
 class DeviceList:
     """ Container for lightweight Device objects, held by ThisDevice. """
@@ -195,8 +378,47 @@ class DeviceList:
         """
 
         # track == -1 denotes a reserve
-        self.devices = []
-        self.track_options = list(range(num_tracks))
+        self._index = {}  # address -> Device, in order added
+        self._order = {}  # address -> position added, breaks ties between reserves
+        self._added = 0  # devices added so far
+        self._sorted = []  # addresses in ascending order, last is highest
+        self._holders = {}  # track -> number of devices assigned it
+        self._free = set()  # tracks of current song no device is assigned
+        self._reserves = []  # (succession key, address) of reserves, kept sorted
+        self._rank = {}  # address -> position in succession
+        self._digest = 0  # running sum of entry checksums, see digest
+        self.track_options = []
+        self.track_priority = []  # track indices of current song, most important first
+        self.update_num_tracks(num_tracks)
+        self._succession = []
+        self.epoch = None  # membership epoch that succession belongs to, None until heard
+
+    @property
+    def devices(self):
+        """
+        :return: list of Devices, in order added.
+        """
+
+        return list(self._index.values())
+
+    @property
+    def succession(self):
+        """
+        :return: addresses in order of leader takeover, set by leader.
+        """
+
+        return self._succession
+
+    @succession.setter
+    def succession(self, succession):
+        """
+        :param succession: addresses in order of leader takeover, SUCCESSION_REMOVED entries for deleted
+            devices, None entries for ranks not heard yet.
+        """
+
+        self._succession = succession
+        self._rank = {address: i for i, address in enumerate(succession) if address not in (None, SUCCESSION_REMOVED)}
+        self._sort_reserves()
 
     def __str__(self):
         """
@@ -205,14 +427,14 @@ class DeviceList:
         """
 
         output = ["DeviceList:"]
-        for device in self.devices:
+        for device in self._index.values():
             track = device.track if device.track is not None else "Reserve"
             output.append(f"Device: {hex(device.address)}, Track: {track}")
         return "\n\t".join(output)
 
     def __iter__(self):
         """
-        Iterator for Devices in DeviceList.
+        Iterator for Devices in DeviceList, safe to remove Devices while iterating.
         :return: iterator object.
         """
 
@@ -224,15 +446,18 @@ class DeviceList:
         :return: number of Devices in DeviceList as an int.
         """
 
-        return len(self.devices)
+        return len(self._index)
 
-    def update_num_tracks(self, num_tracks):
+    def update_num_tracks(self, num_tracks, priority=None):
         """
         Resize DeviceList, used to upscale or downscale tracks.
         :param num_tracks: number of tracks in new song.
+        :param priority: track indices most important first, track order by default.
         """
 
         self.track_options = list(range(num_tracks))
+        self.track_priority = priority if priority is not None else list(self.track_options)
+        self._free = {t for t in self.track_options if self._holders.get(t, 0) == 0}
 
     def add_device(self, address, track):
         """
@@ -241,9 +466,16 @@ class DeviceList:
         :param track: track for device, assigned to new Device object.
         """
 
+        if address in self._index:
+            self.update_track(address, track)
+            return
+
         device = Device(address)
-        device.set_track(track)
-        self.devices.append(device)
+        self._order[address] = self._added
+        self._added += 1
+        insort(self._sorted, address)
+        self._assign(device, track)
+        self._index[address] = device
 
     def find_device(self, address):
         """
@@ -252,10 +484,7 @@ class DeviceList:
         :return: Device object if found, None otherwise.
         """
 
-        for device in self.devices:
-            if device.get_address() == address:
-                return device
-        return None
+        return self._index.get(address)
 
     def remove_device(self, address):
         """
@@ -264,11 +493,70 @@ class DeviceList:
         :return: True if found and removed, False otherwise.
         """
 
-        device = self.find_device(address)
-        if device:
-            self.devices.remove(device)
-            return True
-        return False
+        device = self._index.get(address)
+        if device is not None:
+            self._unassign(device)  # reserve key still needs the rank
+        rank = self._rank.pop(address, None)
+        if rank is not None:
+            self._succession[rank] = SUCCESSION_REMOVED  # keeps ranks in place
+        if device is None:
+            return False
+
+        del self._index[address]
+        del self._order[address]
+        del self._sorted[bisect_left(self._sorted, address)]
+        return True
+
+    def _assign(self, device, track):
+        """
+        Sets a listed Device's track, keeping free tracks, reserves and digest up to date.
+        :param device: Device in DeviceList.
+        :param track: new track, -1 for a reserve.
+        """
+
+        self._unassign(device)
+        device.set_track(track)
+        self._digest += entry_checksum(device.address, track)
+        if track == -1:
+            insort(self._reserves, (self._reserve_key(device.address), device.address))
+        elif track is not None:
+            self._holders[track] = self._holders.get(track, 0) + 1
+            self._free.discard(track)
+
+    def _unassign(self, device):
+        """
+        Undoes bookkeeping for a listed Device's current track.
+        :param device: Device in DeviceList.
+        """
+
+        if self._index.get(device.address) is not device:
+            return  # not listed yet
+        track = device.get_track()
+        self._digest -= entry_checksum(device.address, track)
+        if track == -1:
+            entry = (self._reserve_key(device.address), device.address)
+            del self._reserves[bisect_left(self._reserves, entry)]
+        elif track is not None:
+            self._holders[track] -= 1
+            if self._holders[track] == 0:
+                del self._holders[track]
+                if track < len(self.track_options):
+                    self._free.add(track)
+
+    def _reserve_key(self, address):
+        """
+        :param address: identifier for a reserve.
+        :return: sort key, succession rank first and order added for reserves missing from it.
+        """
+
+        return self._rank.get(address, len(self._succession)), self._order[address]
+
+    def _sort_reserves(self):
+        """
+        Re-sorts reserve queue after succession changed.
+        """
+
+        self._reserves = sorted((self._reserve_key(address), address) for _, address in self._reserves)
 
     def unused_tracks(self):
         """
@@ -276,25 +564,122 @@ class DeviceList:
         :return: list of unused track indices.
         """
 
-        unused_tracks = self.track_options.copy()
-        for d in self.devices:
-            if d.get_track() != -1 and d.get_track() in unused_tracks:
-                unused_tracks.remove(d.get_track())
-        return unused_tracks
+        return sorted(self._free)
+
+    def mix_assignment(self, priority):
+        """
+        Spreads tracks no device is assigned over tracks that are, so the whole song is heard.
+        Most important unassigned tracks go first, each to the assigned track with fewest extras
+        so far, ties to the least important. Depends only on the list, so every device agrees.
+        :param priority: track indices most important first, of current song or the one queued after it.
+        :return: dict of assigned track -> unassigned tracks mixed into it, most important first.
+        """
+
+        rank = {t: i for i, t in enumerate(priority)}
+        assigned = sorted((t for t, n in self._holders.items() if n > 0 and t in rank), key=lambda t: -rank[t])
+        mixes = {t: [] for t in assigned}
+        if len(assigned) == 0:
+            return mixes
+        for track in [t for t in priority if self._holders.get(t, 0) == 0]:
+            mixes[min(assigned, key=lambda t: len(mixes[t]))].append(track)
+        return mixes
+
+    def digest(self, addresses=None):
+        """
+        Compact order-independent summary of membership, equal lists have equal digests.
+        :param addresses: only summarize Devices with these identifiers, all by default.
+        :return: 15 bit int, never mistaken for a -1 option.
+        """
+
+        if addresses is None:
+            return self._digest & 0x7FFF
 
+        total = 0
+        for address in addresses:
+            d = self._index.get(address)
+            if d is not None:
+                total += entry_checksum(d.get_address(), d.get_track())
+        return total & 0x7FFF
 
     def get_reserves(self):
         """
-        Gets list of reserve devices (not currently assigned a track).
+        Gets list of reserve devices (not currently assigned a track), in succession order.
         :return: list of reserve devices.
         """
 
-        reserves = []
-        for d in self.devices:
-            if d.get_track() == -1:
-                reserves.append(d)
+        # devices missing from succession keep DeviceList order after the rest
+        return [self._index[address] for _, address in self._reserves]
+
+    def get_held_tracks(self):
+        """
+        Gets tracks some device is assigned, the ones a reserve can be promoted to.
+        :return: set of tracks.
+        """
+
+        return {t for t, n in self._holders.items() if n > 0}
+
+    def promote_reserve(self):
+        """
+        Assigns first unused track to first reserve in succession order.
+        :return: promoted Device, None if there is no reserve or no unused track.
+        """
+
+        if len(self._free) == 0 or len(self._reserves) == 0:
+            return None
+        reserve = self._index[self._reserves[0][1]]
+        self._assign(reserve, min(self._free))
+        return reserve
+
+    def assign_tracks(self, leader_address=None, pinned=()):
+        """
+        Recomputes track assignment after membership or song changed, so the most important
+        tracks are played and the most suitable devices get them, moving as few devices as possible.
+        Devices on tracks the song no longer has and extra devices sharing a track are freed,
+        then tracks missing from the top of the priority list go to freed devices, reserves and
+        devices on less important tracks, most suitable first.
+        :param leader_address: identifier for leader, always counted as most suitable.
+        :param pinned: addresses that keep a valid track, such as a leader that is playing.
+        :return: list of Devices whose track changed, in DeviceList order.
+        """
+
+        now = time.time()
+        changed = set()
+
+        def suitability(d):
+            return float("inf") if d.get_address() == leader_address else d.suitability(now)
 
-        return reserves
+        def move(d, track):
+            self._assign(d, track)
+            changed.add(d.get_address())
+
+        # tracks song does not have and duplicates, e.g. after a merge, free up their devices
+        holders = {}
+        for d in self._index.values():
+            if d.get_track() is None or d.get_track() == -1:
+                continue
+            if d.get_track() >= len(self.track_options):
+                move(d, -1)
+            else:
+                holders.setdefault(d.get_track(), []).append(d)
+        for ds in holders.values():
+            ds.sort(key=suitability, reverse=True)
+            for d in ds[1:]:
+                move(d, -1)
+
+        # as many tracks are played as there are devices, least important ones go silent
+        playing = [d for d in self._index.values() if d.get_track() not in (None, -1)]
+        reserves = self.get_reserves()
+        wanted = self.track_priority[:min(len(self.track_options), len(playing) + len(reserves))]
+        uncovered = [t for t in wanted if t in self._free]
+        if len(uncovered) == 0:
+            return [d for d in self._index.values() if d.get_address() in changed]
+
+        wanted = set(wanted)
+        surplus = [d for d in playing if d.get_track() not in wanted and d.get_address() not in pinned]
+        candidates = sorted(surplus + reserves, key=suitability, reverse=True)
+        for track, d in zip(uncovered, candidates):
+            move(d, track)
+        return [d for d in self._index.values() if d.get_address() in changed]
 
     def update_track(self, address, track):
         """
@@ -303,359 +688,2665 @@ class DeviceList:
         :param track: new track to be assigned to target.
         """
 
-        for i in range(len(self.devices)):
-            if self.devices[i].get_address() == address:
-                self.devices[i].set_track(track)
+        device = self._index.get(address)
+        if device is not None:
+            self._assign(device, track)
 
-    def get_highest_addr(self):
+    def get_highest_addr(self, exclude=None):
         """
         Gets highest MAC address, used for leader takeover and tiebreaker.
+        :param exclude: address to leave out, such as the current leader.
         :return: max MAC address value.
         """
 
-        max_addr = 0
-        for d in self.devices:
-            if d.get_address() > max_addr:
-                max_addr = d.get_address()
+        for address in reversed(self._sorted):
+            if address != exclude:
+                return address
+        return 0
 
-        return max_addr
+    def succession_order(self, leader_address):
+        """
+        Order in which followers take over as leader, computed by the leader.
+        :param leader_address: identifier for current leader, left out of order.
+        :return: list of follower addresses, highest address first.
+        """
 
+        return [address for address in reversed(self._sorted) if address != leader_address]
 
-class ThisDevice(Device):
-    """ Object for main protocol to use, subclass of Device. """
+    def set_succession(self, epoch, rank, address):
+        """
+        Stores one entry of leader's succession list, starting over on a newer epoch.
+        :param epoch: membership epoch of entry.
+        :param rank: position of address in succession list.
+        :param address: identifier for device at rank.
+        """
 
-    def __init__(self, address):
+        if epoch != self.epoch:
+            if self.epoch is not None and (epoch - self.epoch) % EPOCH_MODULUS >= EPOCH_MODULUS // 2:
+                return  # stale entry from an older epoch
+            self.epoch = epoch
+            self.succession = []
+
+        # entries can arrive out of order or not at all, hold a place for missing ranks
+        while len(self._succession) <= rank:
+            self._succession.append(None)
+        replaced = self._succession[rank]
+        if replaced == SUCCESSION_REMOVED:
+            return  # deleted since, a resent entry does not bring it back
+        if replaced is not None and self._rank.get(replaced) == rank:
+            del self._rank[replaced]
+        self._succession[rank] = address
+        self._rank[address] = rank
+        self._sort_reserves()
+
+    def next_leader(self, exclude=None):
         """
-        Non-default constructor for ThisDevice.
-        :param address: identifier for ThisDevice, consistent with how it is viewed.
+        Gets first device in succession that was not deleted, so every follower agrees
+        even if it missed some list messages. A rank not heard yet may hold the next leader,
+        so an incomplete order falls back to highest address, which every follower agrees on too.
+        :param exclude: address to leave out, such as the current leader.
+        :return: address of next leader, highest address if succession is unknown or incomplete.
         """
 
-        super().__init__(address)
-        self.device_list = DeviceList(8)
-        #self.deleted_devices = DeviceList(8)
-        self.leader_address = 0
-        self.leader_started_playing = None
-        self.song_folder_idx = None
+        for address in self._succession:
+            if address is None:
+                break
+            if address != SUCCESSION_REMOVED and address != exclude:
+                return address
+        return self.get_highest_addr(exclude)
 
-    def send(self, transceiver, msg: int, duration: float):
+    def deputy_groups(self, deputies, leader_address):
         """
-        Sends message through RF antenna, 433 MHz channel.
-        :param transceiver: cc1101 antenna.
-        :param msg: int message to send.
-        :param duration: duration of repeated sending.
+        Splits followers between deputies, computed the same way by leader and deputies.
+        :param deputies: deputy addresses, indexed by group.
+        :param leader_address: identifier for leader, never in a group.
+        :return: dict mapping follower address to group index.
         """
 
-        start_time = time.time()
-        while time.time() - start_time <= duration:
-            if not looping:
-                return
-            print(f"Transmitting {Message(msg)}")
-            transceiver.transmit(
-                msg.to_bytes(length=ceil(msg.bit_length() / 8), byteorder="big")
-            )
-            plt.pause(random.uniform(RAND_LOWER, RAND_UPPER))
+        if len(deputies) == 0:
+            return {}
+        members = sorted(d.get_address() for d in self._index.values()
+                         if d.get_address() != leader_address and d.get_address() not in deputies)
+        return {address: i % len(deputies) for i, address in enumerate(members)}
 
-    def receive(self, transceiver, timeout):
+    def least_loaded_channel(self):
         """
-        Receives message through RF antenna, 433 MHz channel.
-        :param transceiver: cc1101 antenna.
-        :param timeout: how long to wait before quitting.
-        :return: True if message received, False otherwise.
+        Gets data channel with fewest devices, used to spread new followers over channels.
+        :return: index into DATA_FREQUENCIES_HZ.
         """
 
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            if not looping:
-                return False
-            msg = transceiver._wait_for_packet(timedelta(seconds=timeout))
-            if (
-                msg != None and msg.checksum_valid
-            ):
-                msg = msg.payload.hex()[2:]
-                msg = int(msg, 16)
-                self.received = Message(msg)
-                print("Received:", end=" ")
-                print(self.received)
-                return True
-        return False
+        load = [0] * len(DATA_FREQUENCIES_HZ)
+        for d in self._index.values():
+            if d.channel is not None:
+                load[d.channel] += 1
+        return load.index(min(load))
 
-    def setup(self, transceiver):
+    def check_in_batches(self, devices):
         """
-        Boot-up sequance for all devices.
-        :param transceiver: cc1101 antenna.
+        Groups devices so no two in a batch answer on the same data channel.
+        :param devices: scheduled devices, in check-in order.
+        :return: list of batches, each a list of devices.
         """
 
-        print("--------Listening for leader--------")
-        transceiver.set_base_frequency_hertz(433.92e6)
-        transceiver.set_symbol_rate_baud(4800)
-        transceiver.set_output_power(
-            (0, 0xC0)
-        )  # 0xC0 is max power according to cc1101 datasheet
-        #print(transceiver)
-        if self.receive(transceiver, WAIT_FOR_ATTENDANCE_SEC):  # listen for message
-            self.follower_receive_respond_attendance(
-                transceiver
-            )  # will enter for any message
-            self.leader = False
+        batches = []
+        for d in devices:
+            for batch in batches:
+                # devices without a data channel answer on control, always alone
+                if d.channel is not None and all(b.channel not in (None, d.channel) for b in batch):
+                    batch.append(d)
+                    break
+            else:
+                batches.append([d])
+        return batches
+
+    def schedule_check_ins(self, leader_address, cycle_duration, exclude=(), include=None):
+        """
+        Picks followers to check in with this cycle, spending check-ins by risk.
+        Overdue and risky devices are always picked, remaining budget goes to the
+        most urgent of the stable devices.
+        :param leader_address: identifier for leader, never checked in with.
+        :param cycle_duration: expected seconds until the next check-in cycle.
+        :param exclude: addresses checked in with by someone else, such as a deputy.
+        :param include: only consider these addresses, all followers by default.
+        :return: list of devices to check in with, in DeviceList order.
+        """
+
+        now = time.time()
+        followers = [d for d in self._index.values() if d.get_address() != leader_address
+                     and d.get_address() not in exclude
+                     and (include is None or d.get_address() in include)]
+        budget = ceil(sqrt(len(followers)))  # polling load grows sublinearly
+
+        def urgency(device):
+            # fraction of the latency bound used up, boosted by risk
+            elapsed = now - device.last_check_in
+            return elapsed / MAX_CHECK_IN_INTERVAL + device.risk
+
+        scheduled = set()
+        stable = []
+        for d in followers:
+            if (d.last_check_in is None  # newly joined
+                    or now - d.last_check_in + cycle_duration >= MAX_CHECK_IN_INTERVAL
+                    or d.risk >= CHECK_IN_RISK_THRESHOLD):
+                scheduled.add(d.get_address())
+            else:
+                stable.append(d)
+
+        stable.sort(key=urgency, reverse=True)
+        for d in stable[:max(0, budget - len(scheduled))]:
+            scheduled.add(d.get_address())
+
+        return [d for d in followers if d.get_address() in scheduled]
+
+
+class ClockSync:
+    """ Estimates leader's clock offset and drift from round trips, held by ThisDevice. """
+
+    def __init__(self):
+        """
+        Default constructor for ClockSync object.
+        """
+
+        self.samples = []  # (local receive time, offset, round trip) of recent exchanges
+        self.reference = None  # local time offset was last estimated for
+        self.offset = 0  # leader's clock minus this device's clock at reference, in seconds
+        self.drift = 0  # change in offset per second of local time
+        self.error = None  # bound on conversion error at reference, None until synced
+
+    def add_sample(self, sent, leader_time, received):
+        """
+        Records one round trip, assuming both directions take equally long.
+        :param sent: local time request was sent.
+        :param leader_time: leader's time when it replied.
+        :param received: local time reply was received.
+        """
+
+        round_trip = received - sent
+        self.samples.append((received, leader_time - (sent + received) / 2, round_trip))
+        self.samples = self.samples[-TIME_SYNC_SAMPLES:]
+        if len(self.samples) >= TIME_SYNC_MIN_SAMPLES:
+            self.update()
+
+    def update(self):
+        """
+        Filters samples and refits offset and drift. Round trips that took longest waited
+        in queues the most, so only the faster half is trusted.
+        """
+
+        best = sorted(self.samples, key=lambda sample: sample[2])[:max(TIME_SYNC_MIN_SAMPLES, len(self.samples) // 2)]
+        times = [sample[0] for sample in best]
+        offsets = [sample[1] for sample in best]
+        mean_time = sum(times) / len(times)
+        mean_offset = sum(offsets) / len(offsets)
+
+        # least squares line through offsets, once samples are far enough apart to show drift
+        spread = sum((t - mean_time) ** 2 for t in times)
+        if max(times) - min(times) >= TIME_SYNC_DRIFT_SPAN_SEC and spread > 0:
+            self.drift = sum((t - mean_time) * (o - mean_offset) for t, o in zip(times, offsets)) / spread
         else:
-            print("Not received - now leader, sending attendance msg")
+            self.drift = 0
 
-            # leader will take track 0
-            self.track = 0
-            self.leader_addr = self.address
-            self.device_list.add_device(self.get_address(), track=0)
+        self.reference = mean_time
+        self.offset = mean_offset
+        residual = max(abs(o - (mean_offset + self.drift * (t - mean_time))) for t, o in zip(times, offsets))
+        self.error = min(sample[2] for sample in best) / 2 + residual
 
-            self.leader_send_attendance(transceiver)
-            self.leader = True
+    def to_local(self, leader_time):
+        """
+        Converts a time on leader's clock to this device's clock.
+        :param leader_time: leader's time in seconds.
+        :return: local time and its error bound in seconds, None bound if not synced yet.
+        """
 
-    def follower_receive_respond_attendance(self, transceiver):
+        if self.error is None:
+            return leader_time, None  # clocks assumed to agree until synced
+        local = (leader_time - self.offset + self.drift * self.reference) / (1 + self.drift)
+        # drift estimate is only as good as the residual spread over the sampled span
+        extrapolated = abs(local - self.reference) * self.error / TIME_SYNC_DRIFT_SPAN_SEC
+        return local, self.error + extrapolated
+
+
+class TrackCache:
+    """ Decoded, volume-adjusted tracks kept in memory, shared by the whole process. """
+
+    def __init__(self, budget):
         """
-        Follower receives and responds to leader's attendance message.
-        :param transceiver: cc1101 antenna.
+        Non-default constructor for TrackCache object.
+        :param budget: most bytes of decoded audio to keep.
         """
 
-        while (
-            self.received.action != ActionCodes.ATTENDANCE.value
-        ):  # make sure received message is attendance message
-            print("heard messages, waiting for attendance message")
-            self.receive(transceiver, 5)
-            if not looping:
-                return
+        self.budget = budget
+        self.size = 0  # bytes of decoded audio currently kept
+        self.tracks = OrderedDict()  # (song, track, gain) -> AudioSegment over read-only samples, least recently used first
+        self.decoding = {}  # (song, track, gain) -> Event set once a decode in progress is kept
+        self.lock = threading.Lock()
 
-        # attendance message is heard
-        print("Received attendance message from leader, responding")
-        self.leader_address = self.received.leader_addr
+    def get(self, song_path, track_name, gain):
+        """
+        Gets a decoded track, decoding it only if it is not kept already.
+        :param song_path: folder of song.
+        :param track_name: file name of track in song folder.
+        :param gain: dB the track is turned down by.
+        :return: AudioSegment with 16 bit samples.
+        """
 
-        if self.device_list.find_device(self.leader_address) == None:
-            # add leader to first spot in device list with top track by default
-            self.device_list.add_device(self.leader_address, track=0)
+        key = (os.path.normpath(song_path), track_name, gain)
+        while True:
+            with self.lock:
+                if key in self.tracks:
+                    self.tracks.move_to_end(key)
+                    return self.tracks[key]
+                decoding = self.decoding.get(key)
+                if decoding is None:
+                    decoding = self.decoding[key] = threading.Event()
+                    break
+            decoding.wait()  # another thread is decoding it, e.g. a prefetch, then look again
 
-        # sends attendance respone to channel
-        response = create_message(
-            ActionCodes.RESPONSE, self.address, self.leader_address
-        )
-        self.send(transceiver, response, ATTENDANCE_RESPONSE_SEC)
-        # self.make_follower() # comment this out to not display plots
+        # decode outside the lock so hits on other tracks are not held up
+        try:
+            sound = AudioSegment.from_file(os.path.join(song_path, track_name), format="mp3")
+            sound = sound.set_sample_width(2)
+            sound = track_view(AudioSegment(apply_gain(sound.raw_data, gain), sample_width=2,
+                                            frame_rate=sound.frame_rate, channels=sound.channels), 0)
+            self.put(key, sound)
+        finally:
+            with self.lock:
+                del self.decoding[key]
+            decoding.set()
+        return sound
+
+    def peek(self, song_path, track_name, gain):
+        """
+        Gets a decoded track without decoding it.
+        :return: AudioSegment, None if track is not kept.
+        """
 
-    def leader_send_attendance(self, transceiver, playback=None,
-                               leader_started_playing=None, song_folder_idx=None):
+        key = (os.path.normpath(song_path), track_name, gain)
+        with self.lock:
+            if key not in self.tracks:
+                return None
+            self.tracks.move_to_end(key)
+            return self.tracks[key]
+
+    def contains(self, song_path, track_name, gain):
         """
-        Leader sends attendance message, sends list and song info if new follower responds.
-        :param transceiver: cc1101 antenna.
-        :param playback: song that is currently playing.
-        :param leader_started_playing: time when leader began playing.
-        :param song_folder_idx: song identifier.
+        :return: True if track is kept or being decoded.
         """
 
-        msg = create_message(ActionCodes.ATTENDANCE, 0, self.address)
-        self.send(transceiver, msg, SINGLE_SEND_DURATION)
+        key = (os.path.normpath(song_path), track_name, gain)
+        with self.lock:
+            return key in self.tracks or key in self.decoding
 
-        # listen for responses and add unique IDs to device list
-        start_time = time.time()
-        new_devices = False
-        open_tracks = self.device_list.unused_tracks()
-        while time.time() < start_time + ATTENDANCE_RESPONSE_SEC:
-            if not looping:
-                return
-            if self.receive(transceiver, ATTENDANCE_RESPONSE_SEC):
-                received_addr = self.received.follow_addr
-                # look for device in list
-                if ((self.received.action == ActionCodes.RESPONSE.value)
-                        and (self.device_list.find_device(received_addr) == None)):
-                    # puts device in reserves if no more open tracks
-                    track = open_tracks.pop(0) if len(open_tracks) > 0 else -1
-                    # add address to follower list
-                    self.device_list.add_device(address=received_addr, track=track)
-                    new_devices = True
+    def put(self, key, sound):
+        """
+        Keeps a decoded track, dropping least recently used tracks to stay within budget.
+        :param key: (song, track, gain) identifying track.
+        :param sound: decoded AudioSegment.
+        """
 
-        if new_devices:
-            self.leader_send_list(transceiver)
-            if playback != None and playback.is_playing():
-                # leader_send_song_join, may also need to implement follower_receive_song_join
-                self.leader_send_song_join(transceiver, leader_started_playing, song_folder_idx)
+        size = len(sound.raw_data)
+        if size > self.budget:
+            return  # would evict everything and still not fit
+        with self.lock:
+            if key in self.tracks:
+                self.size -= len(self.tracks.pop(key).raw_data)
+            while self.size + size > self.budget:
+                _, evicted = self.tracks.popitem(last=False)
+                self.size -= len(evicted.raw_data)
+            self.tracks[key] = sound
+            self.size += size
 
-    def leader_send_song_join(self, transceiver, leader_started_playing, song_folder_idx):
+
+track_cache = TrackCache(TRACK_CACHE_BYTES)
+prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS)
+
+
+class TrackPack:
+    """ Song compiled by compile_tracks.py, memory-mapped so tracks play without decoding. """
+
+    def __init__(self, path):
         """
-        Leader sends song info to sync a new follower.
-        :param transceiver: cc1101 antenna.
-        :param leader_started_playing: time when leader started playing.
-        :param song_folder_idx: song identifier.
+        Non-default constructor for TrackPack object, reads pack's index.
+        :param path: pack file.
+        """
+
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, num_tracks, self.frame_rate, self.channels,
+         self.sample_width, self.gain) = PACK_HEADER.unpack_from(self.map, 0)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            raise ValueError(f"{path} is not a track pack")
+
+        self.tracks = {}  # track file name -> (byte offset, byte length)
+        for i in range(num_tracks):
+            name, offset, length = PACK_ENTRY.unpack_from(self.map, PACK_HEADER.size + i * PACK_ENTRY.size)
+            self.tracks[name.rstrip(b"\0").decode()] = (offset, length)
+
+    def track(self, track_name, start_ms=0):
+        """
+        Gets a track straight from the mapped pack, only pages that are played are read.
+        :param track_name: file name of track in song folder.
+        :param start_ms: offset into track to start from.
+        :return: AudioSegment backed by the pack.
+        """
+
+        offset, length = self.tracks[track_name]
+        sound = AudioSegment(memoryview(self.map)[offset:offset + length], sample_width=self.sample_width,
+                             frame_rate=self.frame_rate, channels=self.channels)
+        return track_view(sound, start_ms)
+
+    def duration(self, track_name):
+        """
+        :param track_name: file name of track in song folder.
+        :return: length of track in seconds.
+        """
+
+        return self.tracks[track_name][1] / (self.frame_rate * self.channels * self.sample_width)
+
+
+class TrackPlayback:
+    """
+    Decoded track played in one piece, in step with a start time. Restarts at the same position
+    when it moves onto another mix, and at leader's position when beacons show it is too far off.
+    Stands in for simpleaudio's PlayObject.
+    """
+
+    def __init__(self, sound, started, mix=None):
+        """
+        Non-default constructor for TrackPlayback object, starts playing right away.
+        :param sound: decoded track at playback volume.
+        :param started: local time track started at, output skips what was played before now.
+        :param mix: track name and unassigned tracks mixed into sound, see ThisDevice.mix_extras.
+        """
+
+        self.started = started
+        self.sound = sound
+        self.mix = mix
+        self.play_obj = _play_with_simpleaudio(track_view(sound, (time.time() - started) * 1000))
+
+    def switch(self, sound, mix):
+        """
+        Continues playback from another decoded track, e.g. a new mix, at the same position.
+        :param sound: decoded track at playback volume.
+        :param mix: track name and unassigned tracks mixed into sound.
+        """
+
+        play_obj = _play_with_simpleaudio(track_view(sound, (time.time() - self.started) * 1000))
+        self.play_obj.stop()
+        self.play_obj = play_obj
+        self.sound = sound
+        self.mix = mix
+
+    def follow(self, started):
+        """
+        Takes leader's latest start time, playback restarts at leader's position if it is too far off.
+        Smaller differences are left alone, a restart is heard as a short skip.
+        :param started: local time leader's playback started.
+        """
+
+        if abs(started - self.started) < DRIFT_RESTART_SEC or not self.play_obj.is_playing():
+            return
+        print(f"Playback {(started - self.started) * 1000:+.0f} ms off leader's, restarting")
+        self.started = started
+        self.switch(self.sound, self.mix)
+
+    def is_playing(self):
+        """
+        :return: True until track has finished or playback was stopped.
+        """
+
+        return self.play_obj.is_playing()
+
+    def stop(self):
+        """
+        Stops playback.
+        """
+
+        self.play_obj.stop()
+
+
+class StreamPlayback:
+    """
+    Track played one fixed-size chunk at a time, starting from where another playback has got to.
+    Chunks are decoded while the one before plays, or taken from a decoded track without copying.
+    Each chunk seam is a chance to move toward the leader's playback. Without drift correction,
+    the rest of the track plays in one piece once it is decoded, so seams stop there.
+    Stands in for simpleaudio's PlayObject.
+    """
+
+    def __init__(self, path, started, gain, sound=None, mix=None):
+        """
+        Non-default constructor for StreamPlayback object, blocks until first chunk is playing.
+        :param path: MP3 file of track.
+        :param started: local time track started or starts at.
+        :param gain: dB the track is turned down by.
+        :param sound: decoded track at playback volume, track is decoded from path if None.
+        :param mix: track name and unassigned tracks mixed into sound, see ThisDevice.mix_extras.
+        """
+
+        self.path = path
+        self.sound = sound  # decoded track samples are taken from, None while streaming
+        self.mix = mix
+        self.switch_to = None  # decoded track to continue from at next seam
+        self.stopped = threading.Event()
+        self.play_obj = None  # PlayObject of chunk currently playing
+        self.target = started  # local time leader's playback started, moved by beacons
+        self.process = None
+
+        # seek on the input side, ffmpeg jumps to nearest frame instead of decoding up to offset
+        start_sec = max(0, time.time() - started)
+        if sound is None:
+            self.frame_rate, self.channels, self.gain = STREAM_FRAME_RATE, STREAM_CHANNELS, gain
+            self.process = subprocess.Popen(
+                ["ffmpeg", "-v", "quiet", "-ss", f"{start_sec:.3f}", "-i", path, "-vn",
+                 "-f", "s16le", "-ac", str(STREAM_CHANNELS), "-ar", str(STREAM_FRAME_RATE), "pipe:1"],
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+        else:
+            self.frame_rate, self.channels, self.gain = sound.frame_rate, sound.channels, None
+            self.samples = track_view(sound, start_sec * 1000).raw_data
+        self.frame_width = self.channels * 2
+        self.chunk_bytes = round(STREAM_CHUNK_SEC * self.frame_rate) * self.frame_width
+
+        data = self.read_chunk()
+        if len(data) == 0:
+            self.close()
+            raise OSError(f"nothing decoded from {path}")
+        self.next_position = start_sec + self.seconds(data)  # track position where next chunk begins
+
+        # drop what was played elsewhere while first chunk decoded, or wait for start time
+        late = wait_until(started) - start_sec
+        skip = min(max(0, round(late * self.frame_rate)) * self.frame_width, len(data))
+        data = memoryview(data)[skip:]
+
+        self.next_start = time.monotonic()  # when audio after current chunk is due
+        self.play_chunk(data)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def read_chunk(self):
+        """
+        :return: next chunk of samples, shorter at end of track, empty after it.
+        """
+
+        if self.process is not None and self.switch_to is None:
+            self.switch_to = decoded_track(*os.path.split(self.path))  # decoded in the background meanwhile
+        if self.switch_to is not None:
+            self.close()
+            sound = self.sound = self.switch_to
+            self.switch_to = None
+            self.frame_rate, self.channels, self.gain = sound.frame_rate, sound.channels, None
+            self.frame_width = self.channels * 2
+            self.chunk_bytes = round(STREAM_CHUNK_SEC * self.frame_rate) * self.frame_width
+            self.samples = track_view(sound, self.next_position * 1000).raw_data
+        if self.process is None:
+            if not DRIFT_CORRECTION:
+                self.chunk_bytes = len(self.samples)  # nothing to correct at later seams
+            data, self.samples = self.samples[:self.chunk_bytes], self.samples[self.chunk_bytes:]
+            return data
+        data = self.process.stdout.read(self.chunk_bytes)
+        return data[:len(data) - len(data) % self.frame_width]
+
+    def seconds(self, data):
+        """
+        :param data: 16 bit samples.
+        :return: how long samples play for.
+        """
+
+        return len(data) / (self.frame_rate * self.frame_width)
+
+    def play_chunk(self, data):
+        """
+        Plays a chunk of samples, turned down by playback gain if it is not already.
+        :param data: 16 bit samples.
+        """
+
+        if self.gain is not None:
+            data = apply_gain(data, self.gain)
+        chunk = AudioSegment(data, sample_width=2, frame_rate=self.frame_rate, channels=self.channels)
+        self.play_obj = _play_with_simpleaudio(chunk)
+        self.next_start += self.seconds(data)
+
+    def switch(self, sound, mix):
+        """
+        Continues playback from another decoded track, e.g. a new mix, at the same position from the
+        next seam on, or at once if the rest of the track is already playing in one piece.
+        :param sound: decoded track at playback volume.
+        :param mix: track name and unassigned tracks mixed into sound.
+        """
+
+        self.mix = mix
+        if self.thread.is_alive():
+            self.switch_to = sound
+            return
+        play_obj = _play_with_simpleaudio(track_view(sound, (time.time() - self.target) * 1000))
+        self.play_obj.stop()
+        self.play_obj = play_obj
+        self.sound = sound
+
+    def follow(self, started):
+        """
+        Takes leader's latest start time, playback moves toward it from the next seam on. Once the
+        rest of the track plays in one piece, it restarts at leader's position if it is too far off.
+        :param started: local time leader's playback started.
+        """
+
+        off = started - self.target
+        if self.thread.is_alive() or self.sound is None or abs(off) < DRIFT_RESTART_SEC or not self.is_playing():
+            self.target = started
+            return
+        print(f"Playback {off * 1000:+.0f} ms off leader's, restarting")
+        self.target = started
+        self.switch(self.sound, self.mix)
+
+    def correct(self, data):
+        """
+        Adjusts a chunk about to play so playback moves toward leader's. Small differences are
+        absorbed by stretching or squeezing the chunk slightly, large ones by dropping samples
+        or waiting before the chunk.
+        :param data: samples of next chunk.
+        :return: samples to play.
+        """
+
+        # positive when this playback is behind leader's
+        seam = self.next_start + time.time() - time.monotonic()
+        behind = seam - (self.next_position - self.seconds(data)) - self.target
+        if abs(behind) < DRIFT_DEADBAND_SEC:
+            return data
+        frames = len(data) // self.frame_width
+        # rest of track in one piece is too long to stretch in time, it is aligned exactly instead
+        step = DRIFT_STEP_SEC if frames <= round(STREAM_CHUNK_SEC * self.frame_rate) else 0
+        if behind > step:
+            skip = min(round(behind * self.frame_rate) * self.frame_width, len(data))
+            return memoryview(data)[skip:]
+        if behind < -step:
+            self.next_start -= behind
+            return data
+
+        change = min(round(abs(behind) * self.frame_rate), ceil(frames * DRIFT_MAX_STRETCH))
+        return stretch(data, self.channels, frames - change if behind > 0 else frames + change)
+
+    def run(self):
+        """
+        Readies each following chunk while the one before plays, starting it when that one ends.
+        """
+
+        try:
+            while not self.stopped.is_set():
+                data = self.read_chunk()
+                if len(data) == 0:
+                    break
+                self.next_position += self.seconds(data)
+                # seams are timed from first chunk's start, so they do not add up to drift
+                wait = self.next_start - time.monotonic()
+                if self.stopped.wait(max(0, wait - STREAM_CORRECT_SEC)):
+                    break
+                data = self.correct(data)
+                wait_for(self.next_start)
+                self.play_chunk(data)
+                if self.stopped.is_set():  # stopped while chunk was starting
+                    self.play_obj.stop()
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Ends decoder, if track is being decoded.
+        """
+
+        if self.process is not None:
+            self.process.kill()  # unblocks a read waiting on the decoder
+            self.process.stdout.close()
+            self.process = None
+
+    def is_playing(self):
+        """
+        :return: True until the last chunk has finished or playback was stopped.
+        """
+
+        if self.stopped.is_set():
+            return False
+        return self.thread.is_alive() or self.play_obj.is_playing()
+
+    def stop(self):
+        """
+        Stops playback and decoding.
+        """
+
+        self.stopped.set()
+        process = self.process  # decoding thread may be closing it
+        if process is not None:
+            process.kill()
+        if self.play_obj is not None:
+            self.play_obj.stop()
+
+
+track_packs = {}  # song folder -> TrackPack, None if song has no usable pack
+track_durations = {}  # track file -> (modification time, length in seconds) of tracks probed so far
+latest_mix = {}  # (song folder, track name, extras) -> mixed AudioSegment, only the latest mix is kept
+
+
+class Song:
+    """ Lightweight song object for storing in a SongCatalog. """
+
+    def __init__(self, song_id, path):
+        """
+        Non-default constructor for Song object, lists song's tracks.
+        :param song_id: index of song in catalog, sent in song messages.
+        :param path: folder of song.
+        """
+
+        self.song_id = song_id
+        self.path = path
+        self.name = os.path.basename(os.path.normpath(path))
+        self.track_names = sorted(n for n in os.listdir(path) if n != PRIORITY_FILE)
+        self.priority = track_priority(self.track_names, read_priority(path))
+        self.duration = None  # length of longest track in seconds, None if unknown
+
+        # lengths come from pack header or earlier probes, others are probed in the background
+        pack = open_pack(path)
+        unknown = []
+        for track_name in self.track_names:
+            track_path = os.path.join(path, track_name)
+            probed = track_durations.get(track_path)
+            if pack is not None and track_name in pack.tracks:
+                self.duration = max(self.duration or 0, pack.duration(track_name))
+            elif probed is not None and probed[0] == os.path.getmtime(track_path):
+                self.duration = max(self.duration or 0, probed[1])
+            else:
+                unknown.append(track_name)
+        if len(unknown) > 0:
+            prefetch_pool.submit(self.probe_durations, unknown)
+
+    def probe_durations(self, track_names):
+        """
+        Reads lengths of tracks missing from song's pack, run by background workers since each
+        one starts a probe process. Lengths are kept, so listing songs again does not repeat it.
+        :param track_names: file names of tracks in song folder.
+        """
+
+        for track_name in track_names:
+            track_path = os.path.join(self.path, track_name)
+            try:
+                mtime = os.path.getmtime(track_path)
+                duration = float(mediainfo(track_path)["duration"])
+            except (OSError, KeyError, ValueError):
+                continue
+            track_durations[track_path] = (mtime, duration)
+            self.duration = max(self.duration or 0, duration)
+
+
+class SongCatalog:
+    """
+    Songs under tracks folder, listed once and listed again only when the folder changes.
+    Song ids are positions in sorted folder order, the same on every box with the same songs.
+    """
+
+    def __init__(self, audio_path):
+        """
+        Non-default constructor for SongCatalog object, songs are listed by main before the radio starts.
+        :param audio_path: folder of song folders.
+        """
+
+        self.audio_path = audio_path
+        self.songs = None  # Songs indexed by song id
+        self.mtimes = {}  # folder -> modification time when listed
+        self.checked = 0  # time folders were last checked for changes
+
+    def load(self):
+        """
+        Lists every song and its tracks.
+        """
+
+        track_packs.clear()  # packs may have been rebuilt too
+        self.mtimes = {self.audio_path: os.path.getmtime(self.audio_path)}
+        self.songs = []
+        for name in sorted(os.listdir(self.audio_path)):
+            path = os.path.join(self.audio_path, name)
+            self.mtimes[path] = os.path.getmtime(path)
+            self.songs.append(Song(len(self.songs), path))
+        self.checked = time.time()
+        print(f"Catalog lists {len(self.songs)} songs")
+
+    def refresh(self):
+        """
+        Lists songs again if tracks folder or a song folder changed, checked now and then.
+        """
+
+        if self.songs is None:
+            self.load()
+            return
+        if time.time() - self.checked < CATALOG_CHECK_SEC:
+            return
+        self.checked = time.time()
+        for path, mtime in self.mtimes.items():
+            if not os.path.exists(path) or os.path.getmtime(path) != mtime:
+                self.load()
+                return
+
+    def song(self, song_id):
+        """
+        :param song_id: identifier sent in song messages.
+        :return: Song, None if this box does not have it.
+        """
+
+        self.refresh()
+        if song_id is None or not 0 <= song_id < len(self.songs):
+            return None
+        return self.songs[song_id]
+
+    def choose(self, exclude=None):
+        """
+        Picks next song at random, not repeating the last one and keeping within SONG_MAX_SEC.
+        :param exclude: identifier for song just played.
+        :return: song id, None if there are no songs.
+        """
+
+        self.refresh()
+        choices = [s.song_id for s in self.songs if len(s.track_names) > 0
+                   and (SONG_MAX_SEC is None or (s.duration is not None and s.duration <= SONG_MAX_SEC))]
+        if len(choices) > 1 and exclude in choices:
+            choices.remove(exclude)
+        if len(choices) == 0:
+            return None
+        return random.choice(choices)
+
+
+catalog = SongCatalog(AUDIO_PATH)
+
+
+class ThisDevice(Device):
+    """ Object for main protocol to use, subclass of Device. """
+
+    def __init__(self, address):
+        """
+        Non-default constructor for ThisDevice.
+        :param address: identifier for ThisDevice, consistent with how it is viewed.
+        """
+
+        super().__init__(address)
+        self.device_list = DeviceList(8)
+        #self.deleted_devices = DeviceList(8)
+        self.leader_address = 0
+        self.leader_started_playing = None
+        self.song_folder_idx = None
+        self.last_check_in_cycle = None  # start time of leader's previous check-in cycle
+        self.check_in_cycle = 0  # duration of leader's last full cycle
+        self.standby_address = None  # device designated to take over from leader
+        self.lease_sent = None  # time leader last renewed standby's lease
+        self.lease_expiry = None  # time this device takes over, only set for standby
+        self.lease_until = None  # time leader's latest lease runs out, known to every follower
+        self.pending_check_in = None  # check-in standby is waiting to see answered
+        self.leader_digest = None  # leader's membership digest, heard in check-ins
+        self.peer_digests = {}  # membership digests overheard in other followers' responses
+        self.last_gossip_pull = 0  # time this follower last asked a peer for its list
+        self.gossip_pull = None  # addresses heard from peer during current pull
+        self.last_heard = time.time()  # time of last valid message, used to detect silence
+        self.deputies = []  # deputy addresses indexed by group, appointed by leader
+        self.deputy_group = None  # group this device monitors, only set for deputies
+        self.deputy_queue = []  # group members left to check in with this round
+        self.deputy_round = None  # start time of deputy's current round of check-ins
+        self.deputy_cycle = 0  # duration of deputy's last full round
+        self.deputy_pending = None  # deputy's check-in waiting for a response
+        self.deputy_failed = set()  # members deputy has not yet seen deleted by leader
+        self.deputy_reported = 0  # time deputy last reported failures to leader
+        self.received_rssi = None  # signal strength of last received message in dBm
+        self.received_lqi = None  # link quality indicator of last received message
+        self.rate_idx = 0  # index into SYMBOL_RATES_BAUD currently in use
+        self.rate_changed = 0  # time symbol rate last changed
+        self.frames_heard = 0  # frames received since leader last adapted rate
+        self.frame_errors = 0  # checksum failures and missed check-ins since then
+        self.link_error_rate = 0  # running average of frame_errors / frames
+        self.relay_seen = {}  # keys of recently heard messages, mapped to time heard
+        self.relay_queue = []  # replies waiting to be forwarded towards leader
+        self.saved_state = None  # contents of last state write, to skip unchanged writes
+        self.snapshot = None  # header, entries and trailer of snapshot being received
+        self.snapshot_wanted = None  # time joiner started waiting for a snapshot
+        self.snapshot_sent = 0  # time leader last sent a snapshot
+        self.succession_sent = 0  # time leader last sent succession list
+        self.clock = ClockSync()  # leader's clock as seen from this follower
+        self.time_sync_pending = None  # sequence number and send time of unanswered request
+        self.time_sync_sent = 0  # time follower last asked leader for its time
+        self.beacon_sent = 0  # time leader last sent a playback beacon
+        self.next_song = None  # song identifier and local start time of song queued after current one
+        self.next_song_sent = 0  # time leader last announced next song
+        self.next_playback = None  # playback of next song, handed to main loop once started
+        self.next_ready = False  # next song's start time has passed, whether or not this device plays in it
+        self.next_cancel = None  # Event that stops next song's background start
+        self.next_lock = threading.Lock()  # held while next song is handed over or dropped
+        self.next_plan = None  # song, track, unassigned tracks and tracks to prefetch for next song, see plan_next
+        self.prefetched = None  # song and track last prefetched for
+        self.mixing = None  # Future of mix being made in the background
+        self.state_saved = 0  # time state was last written
+
+    def send(self, transceiver, msg: int, duration: float):
+        """
+        Sends message through RF antenna, 433 MHz channel.
+        :param transceiver: cc1101 antenna.
+        :param msg: int message to send.
+        :param duration: duration of repeated sending.
+        """
+
+        if self.leader:
+            self.leader_renew_lease(transceiver)  # leader's lease is renewed before each burst
+        start_time = time.time()
+        while time.time() - start_time <= duration:
+            if not looping:
+                return
+            print(f"Transmitting {Message(msg)}")
+            transceiver.transmit(
+                msg.to_bytes(length=ceil(msg.bit_length() / 8), byteorder="big")
+            )
+            plt.pause(random.uniform(RAND_LOWER, RAND_UPPER))
+
+    def send_once(self, transceiver, msg: int):
+        """
+        Transmits message a single time without pausing after, for exchanges timed on both sides.
+        :param transceiver: cc1101 antenna.
+        :param msg: int message to send.
+        """
+
+        transceiver.transmit(
+            msg.to_bytes(length=ceil(msg.bit_length() / 8), byteorder="big")
+        )
+
+    def send_batch(self, transceiver, msgs, duration: float):
+        """
+        Sends several messages through RF antenna, taking turns within each repetition.
+        :param transceiver: cc1101 antenna.
+        :param msgs: list of int messages to send.
+        :param duration: duration of repeated sending.
+        """
+
+        if self.leader:
+            self.leader_renew_lease(transceiver)
+        start_time = time.time()
+        while time.time() - start_time <= duration:
+            for msg in msgs:
+                if not looping:
+                    return
+                print(f"Transmitting {Message(msg)}")
+                transceiver.transmit(
+                    msg.to_bytes(length=ceil(msg.bit_length() / 8), byteorder="big")
+                )
+            plt.pause(random.uniform(RAND_LOWER, RAND_UPPER))
+
+    def receive(self, transceiver, timeout):
+        """
+        Receives message through RF antenna, 433 MHz channel.
+        :param transceiver: cc1101 antenna.
+        :param timeout: how long to wait before quitting.
+        :return: True if message received, False otherwise.
+        """
+
+        start_time = time.time()
+        while time.time() - start_time < timeout:
+            if not looping:
+                return False
+            packet = transceiver._wait_for_packet(timedelta(seconds=timeout - (time.time() - start_time)))
+            if packet != None and not packet.checksum_valid:
+                self.frame_errors += 1  # counts towards stepping symbol rate down
+            if (
+                packet != None and packet.checksum_valid
+            ):
+                msg = packet.payload.hex()[2:]
+                msg = int(msg, 16)
+                self.frames_heard += 1
+                self.received_rssi = packet.rssi_dbm
+                self.received_lqi = packet.link_quality_indicator
+                self.received = Message(msg)
+                self.last_heard = time.time()
+                print("Received:", end=" ")
+                print(self.received)
+                return True
+        return False
+
+    def setup(self, transceiver):
+        """
+        Boot-up sequance for all devices.
+        :param transceiver: cc1101 antenna.
+        """
+
+        print("--------Listening for leader--------")
+        transceiver.set_base_frequency_hertz(CONTROL_FREQUENCY_HZ)
+        transceiver.set_symbol_rate_baud(SYMBOL_RATES_BAUD[0])
+        transceiver.set_output_power(
+            (0, 0xC0)
+        )  # 0xC0 is max power according to cc1101 datasheet
+        #print(transceiver)
+        start_time = time.time()
+        if self.rejoin(transceiver, self.load_state()):
+            self.leader = False
+            print(f"Rejoined after {time.time() - start_time:.2f}s")
+            return
+
+        probers = self.discover(transceiver)
+        if probers is None:  # existing network heard
+            self.follower_receive_respond_attendance(
+                transceiver
+            )  # will enter for any message
+            self.leader = False
+            return
+
+        # probes lost to collisions can leave several devices thinking they won, they settle it
+        # among themselves, the highest address keeps probing and the rest yield on hearing it
+        winner = max(probers | {self.address})
+        if winner == self.address:
+            print("Claiming leadership")
+            claimers = self.discover(transceiver, CLAIM_ROUND_SEC, self.address)
+            if claimers is None:  # existing network heard
+                self.follower_receive_respond_attendance(transceiver)
+                self.leader = False
+                return
+            probers |= claimers
+            winner = max(probers | {self.address})
+        if winner != self.address:
+            print(f"Waiting for attendance from discovery winner {hex(winner)}")
+            end_time = time.time() + 2 * WAIT_FOR_ATTENDANCE_SEC + CLAIM_ROUND_SEC
+            while self.receive(transceiver, end_time - time.time()):
+                if self.received.action == ActionCodes.PROBE.value:
+                    continue  # claim round still going
+                self.follower_receive_respond_attendance(transceiver)
+                self.leader = False
+                print(f"Joined after {time.time() - start_time:.2f}s of discovery")
+                return
+            # winner went quiet, lead instead
+
+        print("Not received - now leader, sending attendance msg")
+
+        # leader will take track 0
+        self.track = 0
+        self.leader = True
+        self.leader_addr = self.address
+        self.device_list.add_device(self.get_address(), track=0)
+        # devices heard probing are added straight away
+        for address in sorted(probers, reverse=True):
+            self.device_list.add_device(address, -1)
+        self.leader_assign_tracks()
+
+        self.leader_send_attendance(transceiver)
+        if len(probers) > 0:
+            self.leader_send_list(transceiver)
+            self.leader_send_succession(transceiver)
+            self.leader_send_channels(transceiver, list(self.device_list))
+        print(f"Leading {len(self.device_list)} devices after {time.time() - start_time:.2f}s of discovery")
+
+    def discover(self, transceiver, duration=WAIT_FOR_ATTENDANCE_SEC, yield_to=None):
+        """
+        Startup discovery, announces this device with jittered probes and collects
+        probes of devices booting at the same time.
+        :param transceiver: cc1101 antenna.
+        :param duration: how long to probe for.
+        :param yield_to: stop early once a probe from an address above this one is heard, e.g. in the claim round.
+        :return: set of addresses heard probing, None if an existing network was heard.
+        """
+
+        probers = set()
+        end_time = time.time() + duration
+        next_probe = time.time() + random.uniform(0, PROBE_JITTER_SEC)
+        while time.time() < end_time:
+            if not looping:
+                break
+            if time.time() >= next_probe:
+                # a single frame, so this device is back to listening at once
+                self.send_once(transceiver, create_message(ActionCodes.PROBE, self.address, 0))
+                next_probe = time.time() + random.uniform(RAND_LOWER, PROBE_JITTER_SEC)
+
+            timeout = max(min(next_probe, end_time) - time.time(), RAND_LOWER)
+            if self.receive(transceiver, timeout):
+                if self.received.action != ActionCodes.PROBE.value:
+                    return None
+                probers.add(self.received.follow_addr)
+                if yield_to is not None and self.received.follow_addr > yield_to:
+                    print(f"Yielding to {hex(self.received.follow_addr)}")
+                    break
+        return probers
+
+    def state(self):
+        """
+        :return: role and membership of this device, as saved for a warm restart.
+        """
+
+        return {
+            "leader_address": self.leader_address,
+            "track": self.track,
+            "epoch": self.device_list.epoch,
+            "succession": self.device_list.succession,
+            "devices": [[d.get_address(), d.get_track()] for d in self.device_list],
+            "song_folder_idx": self.song_folder_idx,
+            "leader_started_playing": self.leader_started_playing,
+            "rate_idx": self.rate_idx,
+        }
+
+    def save_state(self):
+        """
+        Writes state to local storage when role, membership or song changed or it is about to go
+        stale, replacing the old file in one step so a brownout mid-write leaves the previous state
+        intact. Beacons and rate changes only move other fields, they are saved with the next write.
+        """
+
+        state = self.state()
+        changed = self.saved_state is None or any(state[k] != self.saved_state[k] for k in STATE_SAVE_KEYS)
+        if not changed and time.time() - self.state_saved < STATE_SAVE_INTERVAL_SEC:
+            return
+
+        self.saved_state = state
+        self.state_saved = time.time()
+        tmp_path = STATE_PATH + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(dict(state, saved=self.state_saved), f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, STATE_PATH)
+        except OSError as e:
+            print(f"Could not save state: {e}")
+
+    def load_state(self):
+        """
+        Reads state saved before a reboot.
+        :return: saved state, None if there is none or it is too old to trust.
+        """
+
+        try:
+            with open(STATE_PATH) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - state.get("saved", 0) > STATE_MAX_AGE_SEC:
+            return None
+        return state
+
+    def rejoin(self, transceiver, state):
+        """
+        Rebooted follower asks its old leader to take it back with its saved role, skipping
+        attendance. Leader answers only if it still lists this device.
+        :param transceiver: cc1101 antenna.
+        :param state: state saved before reboot.
+        :return: True if leader took this device back, False to join from scratch.
+        """
+
+        if (state is None or state["track"] is None
+                or state["leader_address"] in (0, self.address)):  # former leader was replaced
+            return False
+
+        print(f"Asking {hex(state['leader_address'])} to rejoin")
+        for address, track in state["devices"]:
+            self.device_list.add_device(address, track)
+        self.device_list.epoch = state["epoch"]
+        self.device_list.succession = state["succession"]
+        self.leader_address = state["leader_address"]
+        self.song_folder_idx = state["song_folder_idx"]
+        self.leader_started_playing = state["leader_started_playing"]
+        self.set_rate(transceiver, state["rate_idx"])
+
+        epoch = state["epoch"] if state["epoch"] is not None else -1
+        msg = create_message(ActionCodes.REJOIN, self.address, self.leader_address, epoch)
+        end_time = time.time() + REJOIN_WAIT_SEC
+        while time.time() < end_time:
+            if not looping:
+                break
+            self.send(transceiver, msg, SINGLE_SEND_DURATION)
+            listen_end = min(time.time() + WAIT_FOR_CHECK_IN_RESPONSE, end_time)
+            while time.time() < listen_end:
+                if (self.receive(transceiver, listen_end - time.time())
+                        and self.received.action == ActionCodes.REJOIN.value
+                        and self.received.follow_addr == self.address
+                        and self.received.leader_addr == self.leader_address):
+                    # leader's epoch in upper option bits, track in lower
+                    track = self.received.options & 0xFF
+                    self.track = -1 if track == 0xFF else track
+                    self.device_list.update_track(self.address, self.track)
+                    if self.received.options >> 8 != epoch:
+                        # membership changed while down, leader resends list and succession
+                        saved = self.device_list
+                        self.device_list = DeviceList(8)
+                        for device in saved:
+                            if device.get_address() in (self.leader_address, self.address):
+                                self.device_list.add_device(device.get_address(), device.get_track())
+                    return True
+
+        # leader gone or dropped this device, forget old network
+        self.device_list = DeviceList(8)
+        self.leader_address = 0
+        self.track = None
+        self.song_folder_idx = None
+        self.leader_started_playing = None
+        self.set_rate(transceiver, 0)
+        return False
+
+    def leader_receive_rejoin(self, transceiver, playback=None):
+        """
+        Leader takes back a rebooted follower it still lists, resending membership if the
+        follower's copy is from an older epoch and song timing so it resumes playback.
+        :param transceiver: cc1101 antenna.
+        :param playback: song that is currently playing.
+        """
+
+        device = self.device_list.find_device(self.received.follow_addr)
+        if device is None or self.received.leader_addr != self.address:
+            return  # dropped already, will join through attendance
+        if device.last_check_in is not None and time.time() - device.last_check_in < WAIT_FOR_CHECK_IN_RESPONSE:
+            return  # repeat of a request already answered
+
+        print(f"{hex(device.get_address())} rejoining after reboot")
+        follower_epoch = self.received.options
+        device.record_check_in(True, time.time())
+        epoch = self.device_list.epoch if self.device_list.epoch is not None else 0
+        msg = create_message(ActionCodes.REJOIN, device.get_address(), self.address,
+                             (epoch << 8) | (device.get_track() & 0xFF))
+        self.send(transceiver, msg, SINGLE_SEND_DURATION)
+
+        if follower_epoch != self.device_list.epoch:
+            self.leader_send_list(transceiver)
+            self.device_list.succession = []  # forces succession out under a new epoch
+            self.leader_send_succession(transceiver)
+        if playback != None and playback.is_playing():
+            self.leader_send_song_join(transceiver, self.leader_started_playing, self.song_folder_idx)
+
+    def follower_receive_respond_attendance(self, transceiver):
+        """
+        Follower receives and responds to leader's attendance message.
+        :param transceiver: cc1101 antenna.
+        """
+
+        while (
+            self.received.action != ActionCodes.ATTENDANCE.value
+        ):  # make sure received message is attendance message
+            print("heard messages, waiting for attendance message")
+            self.receive(transceiver, 5)
+            if not looping:
+                return
+
+        # attendance message is heard
+        print("Received attendance message from leader, responding")
+        if self.received.leader_addr != self.leader_address:
+            self.clock = ClockSync()  # samples were of another leader's clock
+            self.cancel_next()
+        self.leader_address = self.received.leader_addr
+
+        if self.device_list.find_device(self.leader_address) == None:
+            # add leader to first spot in device list with top track by default
+            self.device_list.add_device(self.leader_address, track=0)
+
+        # sends attendance respone to channel
+        # answer as far back as the attendance message travelled
+        response = create_message(
+            ActionCodes.RESPONSE, self.address, self.leader_address, self.gossip_digest(), self.received.hops
+        )
+        network_rate = self.received.options  # attendance is sent at base rate, carries network's
+        self.send(transceiver, response, ATTENDANCE_RESPONSE_SEC)
+        self.set_rate(transceiver, network_rate)
+        self.snapshot_wanted = time.time()  # leader sends one after attendance, asked for if lost
+        # self.make_follower() # comment this out to not display plots
+
+    def leader_send_attendance(self, transceiver, playback=None,
+                               leader_started_playing=None, song_folder_idx=None):
+        """
+        Leader sends attendance message, sends list and song info if new follower responds.
+        :param transceiver: cc1101 antenna.
+        :param playback: song that is currently playing.
+        :param leader_started_playing: time when leader began playing.
+        :param song_folder_idx: song identifier.
+        """
+
+        self.leader_send_beacon(transceiver, playback)
+        self.leader_announce_next(transceiver, playback)
+        # followers cannot hear renewals while leader is at base rate, lease covers attendance
+        self.leader_renew_lease(transceiver, LEASE_PERIOD_SEC + SINGLE_SEND_DURATION + RAND_UPPER + ATTENDANCE_RESPONSE_SEC)
+        # new devices listen at base rate, attendance tells them the network's rate
+        network_rate = self.rate_idx
+        set_symbol_rate(transceiver, 0)
+        msg = create_message(ActionCodes.ATTENDANCE, 0, self.address, network_rate)
+        self.send(transceiver, msg, SINGLE_SEND_DURATION)
+
+        # listen for responses and add unique IDs to device list
+        start_time = time.time()
+        new_devices = []
+        while time.time() < start_time + ATTENDANCE_RESPONSE_SEC:
+            if not looping or not self.leader:
+                break
+            if self.receive(transceiver, start_time + ATTENDANCE_RESPONSE_SEC - time.time()):
+                received_addr = self.received.follow_addr
+                # look for device in list
+                if ((self.received.action == ActionCodes.RESPONSE.value)
+                        and (self.device_list.find_device(received_addr) == None)):
+                    # add address to follower list as reserve, assigned a track once all are heard
+                    self.device_list.add_device(address=received_addr, track=-1)
+                    new_devices.append(self.device_list.find_device(received_addr))
+                else:
+                    self.leader_handle_message(transceiver, playback)
+
+        set_symbol_rate(transceiver, self.rate_idx)
+        if not looping or not self.leader:
+            return
+        self.leader_renew_lease(transceiver)
+
+        if new_devices:
+            changed = self.leader_assign_tracks(playback)
+            if GOSSIP_MODE:
+                # only announce joiners and moved devices, followers pull the rest from each other
+                self.leader_send_list(transceiver, new_devices + [d for d in changed if d not in new_devices])
+                self.leader_send_succession(transceiver)
+                if playback != None and playback.is_playing():
+                    # leader_send_song_join, may also need to implement follower_receive_song_join
+                    self.leader_send_song_join(transceiver, leader_started_playing, song_folder_idx)
+            else:
+                # joiners get everything at once, everyone else picks up the new entries
+                self.leader_send_snapshot(transceiver, playback)
+            self.leader_send_channels(transceiver, new_devices)
+
+    def leader_send_song_join(self, transceiver, leader_started_playing, song_folder_idx):
+        """
+        Leader sends song info to sync a new follower.
+        :param transceiver: cc1101 antenna.
+        :param leader_started_playing: time when leader started playing.
+        :param song_folder_idx: song identifier.
+        """
+
+        start_time_int = round(leader_started_playing * 1000) # get milliseconds
+        msg = create_message(ActionCodes.SONG_JOIN, start_time_int, self.address, song_folder_idx)
+        self.send(transceiver, msg, SINGLE_SEND_DURATION)
+
+    def follower_receive_song_join(self):
+        """
+        Follower syncing playback with leader after hearing song join request.
+        :return: playback info, leader start time, song identifier.
+        """
+
+        leader_start = self.leader_time_to_local(self.received.follow_addr)
+
+        # get song from message
+        song_folder_idx = self.received.options
+
+        # is a reserve but will still have updated information
+        if self.track == None or self.track == -1:
+            return None, leader_start, song_folder_idx
+
+        song = catalog.song(song_folder_idx)
+        if song is None or self.track > len(song.track_names) - 1:
+            return None, leader_start, song_folder_idx
+
+        track_name = song.track_names[self.track]
+
+        self.device_list.update_num_tracks(len(song.track_names))
+        print(f"Playing {track_name}")
+        playback = play_track(song.path, track_name, leader_start, self.mix_extras(song))
+
+        return playback, leader_start, song_folder_idx
+
+    def leader_send_list(self, transceiver, devices=None):
+        """
+        Leader sends updated list to all followers after new follower joins.
+        :param transceiver: cc1101 antenna.
+        :param devices: Devices to send, whole DeviceList by default.
+        """
+
+        if devices is None:
+            devices = list(self.device_list)
+
+        # iterate through devices whose responses have been heard
+        for device in devices:
+            # create list message and send
+            msg = create_message(
+                ActionCodes.N_LIST,
+                device.get_address(),
+                self.address,
+                device.get_track(),
+            )
+            self.send(transceiver, msg, SINGLE_SEND_DURATION)
+            plt.pause(SEND_LIST_DELAY)
+
+    def leader_send_song_start(self, transceiver):
+        """
+        Leader sends song start info to followers connected at song start time.
+        :param transceiver: cc1101 antenna.
+        :return: playback info, leader start time, song identifier.
+        """
+
+        # get start time
+        start_time = time.time() + SONG_START_OFFSET
+        start_time_int = round(start_time * 1000) # get milliseconds
+
+        # choose song randomly and get associated tracks
+        song_folder_idx = catalog.choose(self.song_folder_idx)
+        song = catalog.song(song_folder_idx)
+        if song is None:
+            return None, start_time, song_folder_idx
+
+        # fit assignment to new song before followers hear it
+        self.device_list.update_num_tracks(len(song.track_names), song.priority)
+        changed = self.leader_assign_tracks()
+        if self.track is not None and 0 <= self.track < len(song.track_names):
+            prefetch_track(song.path, song.track_names[self.track])  # decodes while list is sent
+        self.leader_send_list(transceiver, changed)
+
+        if self.track == None or self.track == -1 or self.track > len(song.track_names) - 1:
+            return None, start_time, song_folder_idx
+
+        track_name = song.track_names[self.track]
+
+        # use follower_address part of message for sending start time in ms
+        # sent before leader decodes, so followers decode their tracks meanwhile
+        msg = create_message(ActionCodes.SONG, start_time_int, self.address, song_folder_idx)
+        self.send(transceiver, msg, SINGLE_SEND_DURATION)
+
+        # decoding blocks the leader, keep standby from taking over meanwhile
+        self.leader_renew_lease(transceiver, SONG_LOAD_LEASE_SEC)
+        load_track(song.path, track_name)  # cached, play_track takes it from there
+
+        # if decoding overran start time, playback skips ahead to keep to it anyway
+        print(f"Playing {track_name}")
+        playback = play_track(song.path, track_name, start_time, self.mix_extras(song))
+
+        return playback, start_time, song_folder_idx
+
+    def leader_send_delete(self, transceiver, address):
+        """
+        Leader informs connected followers to delete a disconnected device from DeviceList.
+        :param transceiver: cc1101 antenna.
+        :param address: identifier for Device to drop.
+        """
+
+        msg = create_message(ActionCodes.DELETE, address, self.address)
+        self.send(transceiver, msg, SINGLE_SEND_DURATION)
+
+    def leader_update_succession(self):
+        """
+        Leader moves succession list to a new epoch whenever membership changed.
+        :return: True if succession list changed.
+        """
+
+        succession = self.device_list.succession_order(self.address)
+        if succession == self.device_list.succession:
+            return False
+
+        if self.device_list.epoch is None:
+            self.device_list.epoch = 0
+        else:
+            self.device_list.epoch = (self.device_list.epoch + 1) % EPOCH_MODULUS
+        self.device_list.succession = succession
+        return True
+
+    def leader_send_succession(self, transceiver):
+        """
+        Leader broadcasts succession list under a new epoch whenever membership changed,
+        and again now and then so followers that missed an entry complete their copy.
+        :param transceiver: cc1101 antenna.
+        """
+
+        if not self.leader_update_succession() and time.time() - self.succession_sent < SUCCESSION_REPEAT_SEC:
+            return
+        self.succession_sent = time.time()
+
+        succession = self.device_list.succession
+        for rank, address in enumerate(succession):
+            # epoch in upper option bits, rank in lower
+            msg = create_message(ActionCodes.SUCCESSION, address, self.address,
+                                 (self.device_list.epoch << 8) | rank)
+            self.send(transceiver, msg, SINGLE_SEND_DURATION)
+            plt.pause(SEND_LIST_DELAY)
+
+    def leader_send_snapshot(self, transceiver, playback=None):
+        """
+        Leader sends whole state in one burst: a header with epoch and song timing, one entry
+        per device with its track and succession rank, and a trailer with entry count and
+        membership digest so receivers know the snapshot is complete.
+        :param transceiver: cc1101 antenna.
+        :param playback: song that is currently playing.
+        """
+
+        self.leader_update_succession()
+        self.leader_renew_lease(transceiver)
+        epoch = self.device_list.epoch if self.device_list.epoch is not None else 0
+        if playback != None and playback.is_playing():
+            start_time_int = round(self.leader_started_playing * 1000)  # get milliseconds
+            song = self.song_folder_idx
+        else:
+            start_time_int = 0
+            song = 0xFF  # no song playing
+        msgs = [create_message(ActionCodes.SNAPSHOT, start_time_int, self.address, (epoch << 8) | song)]
+
+        rank = {address: i for i, address in enumerate(self.device_list.succession)
+                if address not in (None, SUCCESSION_REMOVED)}
+        for device in self.device_list:
+            # succession rank in upper option bits, track in lower
+            options = (rank.get(device.get_address(), SNAPSHOT_NO_RANK) << 8) | (device.get_track() & 0xFF)
+            msgs.append(create_message(ActionCodes.SNAPSHOT_ENTRY, device.get_address(), self.address, options))
+
+        msgs.append(create_message(ActionCodes.SNAPSHOT_END, len(self.device_list), self.address,
+                                   self.device_list.digest()))
+        print(f"Sending snapshot of {len(self.device_list)} devices")
+        self.send_batch(transceiver, msgs, SINGLE_SEND_DURATION)
+        self.snapshot_sent = time.time()
+
+    def leader_receive_snapshot_request(self, transceiver, playback=None):
+        """
+        Leader answers a listed follower that missed its snapshot.
+        :param transceiver: cc1101 antenna.
+        :param playback: song that is currently playing.
+        """
+
+        if (self.received.leader_addr != self.address
+                or self.device_list.find_device(self.received.follow_addr) is None):
+            return  # not a member yet, will join through attendance
+        if time.time() - self.snapshot_sent < WAIT_FOR_CHECK_IN_RESPONSE:
+            return  # one snapshot serves every request heard meanwhile
+        self.leader_send_snapshot(transceiver, playback)
+
+    def follower_receive_snapshot(self, playback=None):
+        """
+        Follower collects snapshot frames, adopting the whole snapshot once its trailer
+        confirms every entry arrived. A follower that is not playing starts in sync.
+        :param playback: song info, stopped if this device is moved to another track.
+        :return: new playback if this device started playing, None otherwise.
+        """
+
+        action = self.received.action
+        if action == ActionCodes.SNAPSHOT.value:
+            header = (self.received.follow_addr, self.received.options)
+            if self.snapshot is None or self.snapshot["header"] != header:  # repeats keep entries
+                self.snapshot = {"header": header, "entries": {}}
+            return None
+        if self.snapshot is None:
+            return None  # header missed, wait for the next pass
+        if action == ActionCodes.SNAPSHOT_ENTRY.value:
+            self.snapshot["entries"][self.received.follow_addr] = self.received.options
+            return None
+
+        # trailer
+        entries = self.snapshot["entries"]
+        succession = []
+        tracks = {}
+        for address, options in entries.items():
+            track = options & 0xFF
+            tracks[address] = -1 if track == 0xFF else track
+            rank = options >> 8
+            if rank != SNAPSHOT_NO_RANK:
+                while len(succession) <= rank:
+                    succession.append(None)
+                succession[rank] = address
+        start_time_int, header_options = self.snapshot["header"]
+        self.snapshot = None
+        if (self.received.follow_addr != len(entries)
+                or sum(entry_checksum(a, t) for a, t in tracks.items()) & 0x7FFF != self.received.options):
+            print("Incomplete snapshot, waiting for another")
+            return None
+
+        # adopt in place, followers keep what they recorded about each device
+        for device in self.device_list:
+            if device.get_address() not in tracks:
+                self.device_list.remove_device(device.get_address())
+        for address, track in tracks.items():
+            self.device_list.add_device(address, track)
+        self.device_list.epoch = header_options >> 8
+        self.device_list.succession = succession
+        self.snapshot_wanted = None
+
+        track = tracks.get(self.address)
+        if track != self.track:
+            self.track = track
+            if playback != None:
+                playback.stop()  # restarts on new track below
+            self.change_display_role()
+
+        song_folder_idx = header_options & 0xFF
+        if song_folder_idx == 0xFF:
+            return None
+        self.leader_started_playing = self.leader_time_to_local(start_time_int)
+        self.song_folder_idx = song_folder_idx
+        if (playback != None and playback.is_playing()) or self.track == None or self.track == -1:
+            return None
+
+        song = catalog.song(song_folder_idx)
+        if song is None:
+            return None
+        self.device_list.update_num_tracks(len(song.track_names))
+        if self.track > len(song.track_names) - 1:
+            return None
+        return self.promote_this_reserve(self.leader_started_playing, song_folder_idx)
+
+    def follower_request_snapshot(self, transceiver):
+        """
+        Joiner asks leader for a snapshot if none completed since it joined.
+        :param transceiver: cc1101 antenna.
+        """
+
+        if self.snapshot_wanted is None or time.time() - self.snapshot_wanted < SNAPSHOT_WAIT_SEC:
+            return
+        print("No snapshot heard, asking leader")
+        msg = create_message(ActionCodes.SNAPSHOT_REQUEST, self.address, self.leader_address)
+        self.send(transceiver, msg, SINGLE_SEND_DURATION)
+        self.snapshot_wanted = time.time()  # ask again only after another wait
+
+    def leader_receive_time_sync(self, transceiver):
+        """
+        Leader answers a follower's clock sync request right away with its current time.
+        :param transceiver: cc1101 antenna.
+        """
+
+        if self.received.leader_addr != self.address:
+            return
+        # time in tenths of milliseconds, stamped as late as possible before transmitting
+        msg = create_message(ActionCodes.TIME_SYNC_REPLY, round(time.time() * 10000), self.address,
+                             self.received.options)
+        self.send_once(transceiver, msg)
+
+    def follower_time_sync(self, transceiver):
+        """
+        Follower's background clock sync, asks leader for its time now and then.
+        Reply is handled by follower_receive_time_sync from the main loop.
+        :param transceiver: cc1101 antenna.
+        """
+
+        interval = TIME_SYNC_INTERVAL_SEC if self.clock.error is not None else TIME_SYNC_FAST_SEC
+        if self.leader_address == 0 or time.time() - self.time_sync_sent < interval:
+            return
+        sequence = random.randrange(0xFFFF)  # matches reply to request, never a -1 option
+        msg = create_message(ActionCodes.TIME_SYNC, self.address, self.leader_address, sequence)
+        self.time_sync_sent = time.time()
+        self.time_sync_pending = (sequence, self.time_sync_sent)
+        self.send_once(transceiver, msg)
+
+    def follower_receive_time_sync(self):
+        """
+        Follower turns leader's reply into a clock sample.
+        """
+
+        if self.time_sync_pending is None or self.received.options != self.time_sync_pending[0]:
+            return  # answer to another follower
+        sent = self.time_sync_pending[1]
+        self.time_sync_pending = None
+        if self.last_heard - sent > TIME_SYNC_TIMEOUT:
+            return
+        self.clock.add_sample(sent, self.received.follow_addr / 10000, self.last_heard)
+
+    def leader_time_to_local(self, leader_ms):
+        """
+        Converts a time sent by leader to this device's clock.
+        :param leader_ms: leader's time in milliseconds.
+        :return: local time in seconds.
+        """
+
+        local, error = self.clock.to_local(leader_ms / 1000)
+        if error is not None:
+            print(f"Leader time converted within {error * 1000:.1f} ms")
+        return local
+
+    def leader_send_beacon(self, transceiver, playback=None):
+        """
+        Leader tells followers where its playback is, at most once per beacon interval.
+        Sent as the time its track started, so a beacon stays valid however late it is heard.
+        :param transceiver: cc1101 antenna.
+        :param playback: song that is currently playing.
+        """
+
+        if playback == None or not playback.is_playing() or time.time() - self.beacon_sent < BEACON_INTERVAL_SEC:
+            return
+        self.beacon_sent = time.time()
+        # start time in tenths of milliseconds, like clock sync replies
+        msg = create_message(ActionCodes.BEACON, round(self.leader_started_playing * 10000), self.address,
+                             self.song_folder_idx)
+        self.send_once(transceiver, msg)
+
+    def follower_receive_beacon(self, playback=None):
+        """
+        Follower converts leader's start time with its latest clock estimate and steers playback toward it.
+        :param playback: song info.
+        """
+
+        if self.received.options != self.song_folder_idx:
+            return  # beacon of a song this device has not started
+        started, _ = self.clock.to_local(self.received.follow_addr / 10000)
+        self.leader_started_playing = started
+        if playback is not None:
+            playback.follow(started)
+
+    def leader_announce_next(self, transceiver, playback=None):
+        """
+        Leader picks the song after the current one well before it ends and announces its start,
+        right when the current one ends. Repeated until then, so followers that missed it still preload.
+        :param transceiver: cc1101 antenna.
+        :param playback: song that is currently playing.
+        """
+
+        if self.next_song is None:
+            song = catalog.song(self.song_folder_idx)
+            if (playback == None or not playback.is_playing() or song is None or song.duration is None
+                    or self.leader_started_playing is None):
+                return
+            end = self.leader_started_playing + song.duration
+            if time.time() < end - NEXT_SONG_LOOKAHEAD_SEC:
+                return
+            next_song = catalog.choose(self.song_folder_idx)
+            if catalog.song(next_song) is None:
+                return
+            self.queue_next(next_song, end)
+        elif time.time() - self.next_song_sent < NEXT_SONG_REPEAT_SEC:
+            return
+
+        song_folder_idx, start_time = self.next_song
+        self.next_song_sent = time.time()
+        msg = create_message(ActionCodes.NEXT_SONG, round(start_time * 1000), self.address, song_folder_idx)
+        self.send(transceiver, msg, SINGLE_SEND_DURATION)
+
+    def follower_receive_next_song(self):
+        """
+        Follower queues song announced to follow the current one.
+        """
+
+        song_folder_idx = self.received.options
+        start_time = self.leader_time_to_local(self.received.follow_addr)
+        if self.next_song is not None and self.next_song[0] == song_folder_idx:
+            if abs(self.next_song[1] - start_time) < DRIFT_STEP_SEC:
+                return  # repeated announcement, clock estimate may have moved a little
+            if time.time() > self.next_song[1] - NEXT_SONG_PREPARE_SEC:
+                return  # already starting, beacons correct the start once it plays
+        self.queue_next(song_folder_idx, start_time)
+
+    def queue_next(self, song_folder_idx, start_time):
+        """
+        Preloads next song in the background and starts it at its start time, current song plays out meanwhile.
+        :param song_folder_idx: song identifier.
+        :param start_time: local time next song starts at.
+        """
+
+        self.cancel_next()
+        print(f"Queued song {song_folder_idx} to start in {start_time - time.time():.1f}s")
+        self.next_song = (song_folder_idx, start_time)
+        self.plan_next()
+        self.next_cancel = threading.Event()
+        threading.Thread(target=self.play_next, args=(song_folder_idx, start_time, self.next_cancel),
+                         daemon=True).start()
+
+    def plan_next(self):
+        """
+        Works out what this device plays in next song, kept up to date as devices join and leave.
+        Runs on the main loop, which owns the device list, play_next only reads the result.
+        """
+
+        if self.next_song is None:
+            self.next_plan = None
+            return
+        song = catalog.song(self.next_song[0])
+        if song is None or self.track is None:
+            self.next_plan = None
+            return
+        if self.track == -1:
+            self.next_plan = (self.next_song[0], -1, (), tuple(self.reserve_tracks(song)))
+        elif self.track < len(song.track_names):
+            self.next_plan = (self.next_song[0], self.track, self.mix_extras(song), (self.track,))
+        else:
+            self.next_plan = (self.next_song[0], self.track, (), ())
+
+    def play_next(self, song_folder_idx, start_time, cancel):
+        """
+        Background start of next song. Tracks are prefetched right away, the track to play is
+        picked shortly before start time, as assignment may change until then.
+        Assignment is taken from plan_next, never from the device list itself.
+        :param song_folder_idx: song identifier.
+        :param start_time: local time next song starts at.
+        :param cancel: Event set if next song was replaced or dropped.
+        """
+
+        playback = None
+        try:
+            song = catalog.song(song_folder_idx)
+            plan = self.next_plan
+            if song is None or plan is None or plan[0] != song_folder_idx:
+                return
+            _, track, extras, tracks = plan
+            for t in tracks:
+                prefetch_track(song.path, song.track_names[t])
+            for track_name, _ in extras:
+                prefetch_track(song.path, track_name)
+            if len(extras) > 0:
+                prefetch_pool.submit(prefetch_mix, song.path, song.track_names[track], extras)
+
+            if cancel.wait(max(0, start_time - NEXT_SONG_PREPARE_SEC - time.time())):
+                return
+            plan = self.next_plan
+            if plan is None or plan[0] != song_folder_idx or not 0 <= plan[1] < len(song.track_names):
+                return  # no part in next song, leader reassigns once it started
+            _, track, extras, _ = plan
+            print(f"Playing {song.track_names[track]}")
+            playback = play_track(song.path, song.track_names[track], start_time, extras)
+        finally:
+            # main loop may be dropping next song meanwhile
+            with self.next_lock:
+                if cancel.is_set():
+                    if playback is not None:
+                        playback.stop()
+                else:
+                    self.next_playback = playback
+                    self.next_ready = True
+
+    def take_next_song(self):
+        """
+        Hands next song over to main loop once it started, it carries on with it as current song.
+        :return: playback info, start time, song identifier.
+        """
+
+        with self.next_lock:
+            song_folder_idx, start_time = self.next_song
+            playback = self.next_playback
+            self.next_song = None
+            self.next_plan = None
+            self.next_playback = None
+            self.next_ready = False
+            self.next_cancel = None
+
+        song = catalog.song(song_folder_idx)
+        if song is not None:
+            self.device_list.update_num_tracks(len(song.track_names), song.priority)
+        self.leader_started_playing = start_time
+        self.song_folder_idx = song_folder_idx
+        return playback, start_time, song_folder_idx
+
+    def cancel_next(self):
+        """
+        Drops queued next song, e.g. after moving to another leader's network.
+        """
+
+        with self.next_lock:
+            if self.next_cancel is not None:
+                self.next_cancel.set()
+            if self.next_playback is not None:
+                self.next_playback.stop()
+            self.next_song = None
+            self.next_plan = None
+            self.next_playback = None
+            self.next_ready = False
+            self.next_cancel = None
+
+    def leader_start_next_song(self, transceiver):
+        """
+        Leader carries on with next song once it started, fitting assignment to it.
+        Followers moved to another track, or that missed the announcement, join through song join.
+        :param transceiver: cc1101 antenna.
+        :return: playback info, start time, song identifier.
+        """
+
+        playback, start_time, song_folder_idx = self.take_next_song()
+        song = catalog.song(song_folder_idx)
+        if song is None:
+            return playback, start_time, song_folder_idx
+
+        self.leader_send_list(transceiver, self.leader_assign_tracks(playback))
+        if playback == None and self.track is not None and 0 <= self.track < len(song.track_names):
+            # leader was moved onto a track of next song, joins it like a late follower
+            self.leader_renew_lease(transceiver, SONG_LOAD_LEASE_SEC)  # may have to decode it
+            print(f"Playing {song.track_names[self.track]}")
+            playback = play_track(song.path, song.track_names[self.track], start_time, self.mix_extras(song))
+        self.leader_send_song_join(transceiver, start_time, song_folder_idx)
+        return playback, start_time, song_folder_idx
+
+    def follower_receive_succession(self):
+        """
+        Follower updates its copy of leader's succession list.
+        """
+
+        epoch = self.received.options >> 8
+        rank = self.received.options & 0xFF
+        self.device_list.set_succession(epoch, rank, self.received.follow_addr)
+
+    def leader_renew_lease(self, transceiver, period=LEASE_PERIOD_SEC):
+        """
+        Leader renews standby's lease before each of its bursts and right after each response window.
+        A single frame, so renewing costs no listening time, never sent inside a response window.
+        :param transceiver: cc1101 antenna.
+        :param period: seconds standby waits for next renewal before taking over.
+        """
+
+        standby = self.device_list.next_leader(exclude=self.address)
+        if standby == 0:  # no followers to take over
+            self.standby_address = None
+            return
+
+        if (standby == self.standby_address and period == LEASE_PERIOD_SEC
+                and time.time() - self.lease_sent < SINGLE_SEND_DURATION):
+            return
+
+        self.standby_address = standby
+        self.lease_sent = time.time()
+        # lease period is sent in tenths of a second
+        msg = create_message(ActionCodes.LEASE, standby, self.address, round(period * 10))
+        print(f"Transmitting {Message(msg)}")
+        self.send_once(transceiver, msg)
+
+    def follower_receive_lease(self):
+        """
+        Follower records standby leader and how long leader's lease runs, standby also extends its lease.
+        """
+
+        self.standby_address = self.received.follow_addr
+        self.lease_until = time.time() + self.received.options / 10
+        if self.standby_address == self.address:
+            self.lease_expiry = time.time() + self.received.options / 10
+        else:
+            self.lease_expiry = None
+            self.pending_check_in = None
+
+    def lease_expired(self):
+        """
+        :return: True if this device is standby and leader failed to renew its lease.
+        """
+
+        return self.lease_expiry is not None and time.time() >= self.lease_expiry
+
+    def follower_silence_threshold(self):
+        """
+        At a raised rate, a silent leader may just be at base rate for attendance or loading a song,
+        so follower falls back to base rate before it considers a takeover. While a lease runs,
+        e.g. a longer one over a song load, the leader is not missing. Once it runs out the standby
+        takes over, other followers give it a full threshold to be heard as leader before racing it.
+        :return: seconds of silence before takeover stage.
+        """
+
+        threshold = FOLLOWER_LISTEN_THRESHOLD
+        if self.rate_idx != 0:
+            threshold = RATE_FALLBACK_SEC + FOLLOWER_LISTEN_THRESHOLD
+        if self.lease_until is not None:
+            lease_left = self.lease_until - self.last_heard
+            if self.standby_address != self.address:
+                lease_left += FOLLOWER_LISTEN_THRESHOLD
+            threshold = max(threshold, lease_left)
+        return threshold
+
+    def follower_listen_timeout(self):
+        """
+        Standby stops listening at lease expiry instead of waiting out full silence.
+        :return: seconds to listen before starting takeover.
+        """
+
+        timeout = FOLLOWER_LISTEN_THRESHOLD
+        if self.rate_idx != 0:
+            timeout = RATE_FALLBACK_SEC  # check for a failed rate change in time
+        if self.deputy_group is not None:
+            timeout = DEPUTY_TICK_SEC  # deputy has its own check-ins to run
+        if len(self.relay_queue) > 0:
+            timeout = min(timeout, RELAY_AGGREGATE_SEC)  # replies are waiting to be forwarded
+        if self.lease_expiry is None:
+            return timeout
+        return min(timeout, max(self.lease_expiry - time.time(), RAND_LOWER))
+
+    def standby_observe(self):
+        """
+        Standby mirrors leader's check-in history from overheard check-ins and responses.
+        """
+
+        if self.lease_expiry is None or MULTI_CHANNEL_MODE:
+            return  # responses on data channels can't be overheard
+
+        now = time.time()
+        check_in_window = SINGLE_SEND_DURATION + WAIT_FOR_CHECK_IN_RESPONSE
+        if self.pending_check_in is not None:
+            address, check_in_time = self.pending_check_in
+            device = self.device_list.find_device(address)
+            if device is None:  # deleted meanwhile
+                self.pending_check_in = None
+            elif (self.received.action == ActionCodes.RESPONSE.value
+                    and self.received.follow_addr == address):
+                device.record_check_in(True, check_in_time)
+                self.pending_check_in = None
+            elif now - check_in_time > check_in_window or (
+                    self.received.action == ActionCodes.CHECK_IN.value
+                    and self.received.follow_addr != address):
+                device.record_check_in(False, check_in_time)
+                self.pending_check_in = None
+
+        if (self.pending_check_in is None
+                and self.received.action == ActionCodes.CHECK_IN.value
+                and self.received.follow_addr != self.address):
+            device = self.device_list.find_device(self.received.follow_addr)
+            # leader repeats each check-in, only count the first copy
+            if device is not None and (device.last_check_in is None
+                                       or now - device.last_check_in > check_in_window):
+                self.pending_check_in = (device.get_address(), now)
+
+    def leader_check_in(self, transceiver, playback=None):
+        """
+        Leader sends check-in message to followers picked by risk-weighted schedule.
+        :param transceiver: cc1101 antenna.
+        :param playback: song that is currently playing.
+        """
+
+        cycle_start = time.time()
+        if self.last_check_in_cycle is not None:
+            self.check_in_cycle = cycle_start - self.last_check_in_cycle
+        self.last_check_in_cycle = cycle_start
+        self.leader_send_reassignments(transceiver, playback)  # e.g. after taking over
+        self.prefetch()
+        self.update_mix(playback)
+        self.plan_next()
+        self.leader_send_succession(transceiver)
+        self.leader_appoint_deputies(transceiver)
+
+        # schedule is a copy, safe to remove devices while iterating
+        deputized = self.device_list.deputy_groups(self.deputies, self.address)
+        schedule = self.device_list.schedule_check_ins(self.address, self.check_in_cycle, deputized)
+        if MULTI_CHANNEL_MODE:
+            self.leader_check_in_channels(transceiver, schedule, playback)
+            return
+
+        for device in schedule:
+            if not looping or not self.leader:
+                return
+            self.leader_send_beacon(transceiver, playback)
+            self.leader_announce_next(transceiver, playback)
+            address = device.get_address()
+            msg = create_message(ActionCodes.CHECK_IN, address, self.address, self.gossip_digest())
+            check_in_time = time.time()
+            self.send(transceiver, msg, SINGLE_SEND_DURATION)
+            self.leader_renew_lease(transceiver)  # followers wait CHECK_IN_DELAY before answering
+
+            responded = False
+            start_time = time.time()
+            while time.time() < start_time + WAIT_FOR_CHECK_IN_RESPONSE:
+                if self.receive(transceiver, start_time + WAIT_FOR_CHECK_IN_RESPONSE - time.time()):
+                    if (self.received.action == ActionCodes.RESPONSE.value
+                            and self.received.follow_addr == address):
+                        responded = True
+                        device.record_link(self.received_rssi, self.received_lqi)
+                        break
+                    self.leader_handle_message(transceiver, playback)
+                    if not self.leader:
+                        return
+
+            self.leader_renew_lease(transceiver)
+            self.leader_record_check_in(transceiver, device, responded, check_in_time, playback)
+            plt.pause(CHECK_IN_DELAY)
+
+    def leader_check_in_channels(self, transceiver, schedule, playback=None):
+        """
+        Leader checks in with one follower per data channel at once, hopping between
+        channels while they respond in parallel.
+        :param transceiver: cc1101 antenna.
+        :param schedule: devices to check in with this cycle.
+        :param playback: song that is currently playing.
+        """
+
+        for batch in self.device_list.check_in_batches(schedule):
+            if not looping or not self.leader:
+                return
+            self.leader_send_beacon(transceiver, playback)
+            self.leader_announce_next(transceiver, playback)
+            msgs = [create_message(ActionCodes.CHECK_IN, d.get_address(), self.address, self.gossip_digest())
+                    for d in batch]
+            check_in_time = time.time()
+            self.send_batch(transceiver, msgs, SINGLE_SEND_DURATION)
+            self.leader_renew_lease(transceiver)  # followers wait CHECK_IN_DELAY before answering
+
+            waiting = {d.get_address(): d for d in batch}
+            start_time = time.time()
+            while len(waiting) > 0 and time.time() < start_time + WAIT_FOR_CHECK_IN_RESPONSE:
+                for device in list(waiting.values()):
+                    set_channel(transceiver, device.channel)
+                    dwell = CHANNEL_DWELL_SEC if device.channel is not None else WAIT_FOR_CHECK_IN_RESPONSE
+                    if (self.receive(transceiver, dwell)
+                            and self.received.action == ActionCodes.RESPONSE.value
+                            and self.received.follow_addr in waiting):
+                        waiting.pop(self.received.follow_addr).record_link(self.received_rssi, self.received_lqi)
+            set_channel(transceiver, None)
+            self.leader_renew_lease(transceiver)
+
+            for device in batch:
+                self.leader_record_check_in(transceiver, device, device.get_address() not in waiting,
+                                            check_in_time, playback)
+            plt.pause(CHECK_IN_DELAY)
+
+    def leader_record_check_in(self, transceiver, device, responded, check_in_time, playback=None):
+        """
+        Leader records check-in result, deletes device after too many missed check-ins.
+        :param transceiver: cc1101 antenna.
+        :param device: Device that was checked in with.
+        :param responded: True if device responded.
+        :param check_in_time: time check-in was sent.
+        :param playback: song that is currently playing.
+        """
+
+        device.record_check_in(responded, check_in_time)
+        if not responded:
+            self.frame_errors += 1  # counts towards stepping symbol rate down
+            print(f"Missed check-in from {hex(device.get_address())}, risk {device.risk:.2f}")
+            if device.missed >= MAX_MISSED_CHECK_INS:  # improves robustness against noisy channel
+                self.leader_delete_device(transceiver, device, playback)
+
+    def leader_delete_device(self, transceiver, device, playback=None):
+        """
+        Leader drops a disconnected device and hands its track to the most suitable reserve.
+        :param transceiver: cc1101 antenna.
+        :param device: Device to drop.
+        :param playback: song that is currently playing.
+        """
+
+        address = device.get_address()
+        self.device_list.remove_device(
+            address
+        )  # delete from leader's copy
+        self.leader_send_delete(transceiver, address)
+
+        if device.track != -1:  # deleted a device that was playing a track
+            self.leader_send_reassignments(transceiver, playback)
+        self.leader_send_succession(transceiver)
+
+    def leader_assign_tracks(self, playback=None):
+        """
+        Leader reruns track assignment, following its own entry if it moved.
+        :param playback: song that is currently playing, leader keeps its track while it plays.
+        :return: list of Devices whose track changed.
+        """
+
+        playing = playback != None and playback.is_playing()
+        changed = self.device_list.assign_tracks(self.address, (self.address,) if playing else ())
+        leader = self.device_list.find_device(self.address)
+        if leader is not None and leader.get_track() != self.track:
+            self.track = leader.get_track()
+            self.change_display_role()
+        return changed
+
+    def leader_send_reassignments(self, transceiver, playback=None):
+        """
+        Leader reruns track assignment and sends only entries that changed, then song info
+        so moved followers restart on their new tracks.
+        :param transceiver: cc1101 antenna.
+        :param playback: song that is currently playing.
+        """
+
+        changed = self.leader_assign_tracks(playback)
+        if len(changed) == 0:
+            return
+        self.leader_send_list(transceiver, changed)
+        if playback != None and playback.is_playing():
+            self.leader_send_song_join(transceiver, self.leader_started_playing, self.song_folder_idx)
+
+    def leader_appoint_deputies(self, transceiver):
+        """
+        Leader appoints its most stable followers as deputies once the ensemble is large,
+        keeping existing deputies where possible.
+        :param transceiver: cc1101 antenna.
+        """
+
+        # deputies can't hear responses sent on data channels
+        if not DEPUTY_MODE or MULTI_CHANNEL_MODE:
+            return
+
+        followers = [d for d in self.device_list if d.get_address() != self.address]
+        deputies = []
+        if len(followers) >= DEPUTY_MIN_FOLLOWERS:
+            deputies = [a for a in self.deputies if self.device_list.find_device(a) is not None]
+            for d in sorted(followers, key=lambda d: (d.risk, -d.get_address())):
+                if len(deputies) >= MAX_DEPUTIES:
+                    break
+                if d.get_address() not in deputies:
+                    deputies.append(d.get_address())
+
+        if deputies == self.deputies:
+            return
+
+        self.deputies = deputies
+        if len(deputies) == 0:
+            # no groups left, deputies go back to being plain followers
+            msgs = [create_message(ActionCodes.DEPUTY, 0, self.address, 0)]
+        else:
+            # group index in upper option bits, number of groups in lower
+            msgs = [create_message(ActionCodes.DEPUTY, address, self.address, (group << 8) | len(deputies))
+                    for group, address in enumerate(deputies)]
+        self.send_batch(transceiver, msgs, SINGLE_SEND_DURATION)
+
+    def leader_receive_report(self, transceiver, playback=None):
+        """
+        Leader drops a follower that a deputy reported as disconnected.
+        :param transceiver: cc1101 antenna.
+        :param playback: song that is currently playing.
+        """
+
+        device = self.device_list.find_device(self.received.follow_addr)
+        if device is not None and device.get_address() != self.address:
+            print(f"Deputy reported {hex(device.get_address())} missing")
+            self.leader_delete_device(transceiver, device, playback)
+
+    def leader_send_channels(self, transceiver, devices):
+        """
+        Leader assigns new followers to data channels in multi-channel mode.
+        :param transceiver: cc1101 antenna.
+        :param devices: newly added Devices.
+        """
+
+        if not MULTI_CHANNEL_MODE:
+            return
+
+        for device in devices:
+            if device.get_address() == self.address or device.channel is not None:
+                continue
+            device.channel = self.device_list.least_loaded_channel()
+            msg = create_message(ActionCodes.CHANNEL, device.get_address(), self.address, device.channel)
+            self.send(transceiver, msg, SINGLE_SEND_DURATION)
+            plt.pause(SEND_LIST_DELAY)
+
+    def follower_receive_deputy(self):
+        """
+        Follower records deputy appointment, its own or another follower's.
+        """
+
+        num_groups = self.received.options & 0xFF
+        group = self.received.options >> 8
+        if num_groups == 0:
+            self.deputies = []
+            self.deputy_group = None
+            return
+
+        if len(self.deputies) != num_groups:
+            self.deputies = [None] * num_groups
+        self.deputies[group] = self.received.follow_addr
+        if self.received.follow_addr == self.address:
+            if self.deputy_group != group:
+                print(f"Appointed deputy for group {group}")
+                self.deputy_queue = []
+            self.deputy_group = group
+        elif self.deputy_group == group:
+            self.deputy_group = None  # replaced by another deputy
+
+        if self.deputy_group is None:
+            self.deputy_pending = None
+            self.deputy_failed = set()
+
+    def deputy_observe(self):
+        """
+        Deputy matches a heard response with its outstanding check-in.
+        """
+
+        if (self.deputy_pending is not None
+                and self.received.action == ActionCodes.RESPONSE.value
+                and self.received.follow_addr == self.deputy_pending[0]):
+            address, check_in_time = self.deputy_pending
+            device = self.device_list.find_device(address)
+            if device is not None:
+                device.record_check_in(True, check_in_time)
+            self.deputy_pending = None
+
+    def deputy_tick(self, transceiver):
+        """
+        Deputy checks in with its group one member at a time between leader messages,
+        and reports disconnected members to leader in one batch.
+        :param transceiver: cc1101 antenna.
+        """
+
+        if self.deputy_group is None:
+            return
+
+        now = time.time()
+        if self.deputy_pending is not None:
+            address, check_in_time = self.deputy_pending
+            device = self.device_list.find_device(address)
+            if device is None:
+                self.deputy_pending = None
+            elif now - check_in_time > SINGLE_SEND_DURATION + WAIT_FOR_CHECK_IN_RESPONSE:
+                device.record_check_in(False, check_in_time)
+                self.deputy_pending = None
+                if device.missed >= MAX_MISSED_CHECK_INS:
+                    self.deputy_failed.add(address)
+
+        if len(self.deputy_failed) > 0 and now - self.deputy_reported > DEPUTY_REPORT_INTERVAL:
+            msgs = [create_message(ActionCodes.REPORT, address, self.leader_address, self.deputy_group)
+                    for address in sorted(self.deputy_failed)]
+            self.send_batch(transceiver, msgs, SINGLE_SEND_DURATION)
+            self.deputy_reported = time.time()
+
+        if self.deputy_pending is not None:
+            return
+
+        if len(self.deputy_queue) == 0:
+            # start a new round using the same risk-weighted schedule as the leader
+            if self.deputy_round is not None:
+                self.deputy_cycle = now - self.deputy_round
+            self.deputy_round = now
+            groups = self.device_list.deputy_groups(self.deputies, self.leader_address)
+            members = {a for a, group in groups.items() if group == self.deputy_group and a != self.address}
+            self.deputy_queue = [d.get_address() for d in self.device_list.schedule_check_ins(
+                self.leader_address, self.deputy_cycle, self.deputy_failed, members)]
+            if len(self.deputy_queue) == 0:
+                return
+
+        address = self.deputy_queue.pop(0)
+        if self.device_list.find_device(address) is None:
+            return
+        # deputy checks in on leader's behalf, members answer as usual
+        msg = create_message(ActionCodes.CHECK_IN, address, self.leader_address, self.gossip_digest())
+        self.deputy_pending = (address, time.time())
+        self.send(transceiver, msg, SINGLE_SEND_DURATION)
+
+    def follower_relay(self, transceiver):
+        """
+        Follower forwards leader messages away from leader and queues replies to forward
+        back, suppressing copies it has already heard.
+        :param transceiver: cc1101 antenna.
+        :return: True if message is a duplicate that was already handled.
+        """
+
+        if not RELAY_MODE:
+            return False
+
+        now = time.time()
+        for key, heard in list(self.relay_seen.items()):
+            if now - heard > RELAY_DUPLICATE_SEC:
+                del self.relay_seen[key]
+        if self.received.key in self.relay_seen:
+            return True
+        self.relay_seen[self.received.key] = now
+
+        action = self.received.action
+        hops = self.received.hops
+        if action in REPLY_ACTIONS:
+            if hops > 0:  # sent from beyond leader's range
+                self.relay_queue.append((create_message(
+                    ActionCodes(action), self.received.follow_addr, self.received.leader_addr,
+                    self.received.options, hops - 1), now))
+        elif action in RELAYED_ACTIONS and hops < MAX_HOPS:
+            # boxes near leader stay quiet, edge of range or earlier relays forward
+            if hops > 0 or self.received_rssi < RELAY_RSSI_DBM:
+                msg = create_message(ActionCodes(action), self.received.follow_addr,
+                                     self.received.leader_addr, self.received.options, hops + 1)
+                plt.pause(random.uniform(RAND_LOWER, RAND_UPPER))  # stagger relays
+                self.send(transceiver, msg, SINGLE_SEND_DURATION)
+
+        self.relay_flush(transceiver)
+        return False
+
+    def relay_flush(self, transceiver):
+        """
+        Relay forwards collected replies towards leader in one batch.
+        :param transceiver: cc1101 antenna.
+        """
+
+        if len(self.relay_queue) == 0 or time.time() - self.relay_queue[0][1] < RELAY_AGGREGATE_SEC:
+            return
+        msgs = [msg for msg, _ in self.relay_queue]
+        self.relay_queue = []
+        self.send_batch(transceiver, msgs, SINGLE_SEND_DURATION)
+
+    def follower_tick(self, transceiver, playback=None):
+        """
+        Follower's background work between messages, deputy check-ins and relayed replies.
+        :param transceiver: cc1101 antenna.
+        :param playback: song info.
+        """
+
+        self.deputy_tick(transceiver)
+        self.relay_flush(transceiver)
+        self.follower_request_snapshot(transceiver)
+        self.follower_time_sync(transceiver)
+        self.prefetch()
+        self.update_mix(playback)
+        self.plan_next()
+
+    def prefetch(self):
+        """
+        Decodes tracks of current song this device may be asked to play, in the background.
+        Own track comes first, reserves prepare the tracks they are most likely to be needed for,
+        see reserve_tracks.
+        """
+
+        song = catalog.song(self.song_folder_idx)
+        if song is None or self.track is None:
+            return
+        extras = self.mix_extras(song)
+        if (self.song_folder_idx, self.track, extras) == self.prefetched:
+            return
+        self.prefetched = (self.song_folder_idx, self.track, extras)
+
+        tracks = [song.track_names[self.track]] if 0 <= self.track < len(song.track_names) else []
+        if self.track == -1:
+            tracks = [song.track_names[track] for track in self.reserve_tracks(song)]
+        for track_name in tracks + [name for name, _ in extras]:
+            prefetch_track(song.path, track_name)
+        if len(extras) > 0:
+            self.mixing = prefetch_pool.submit(prefetch_mix, song.path, song.track_names[self.track], extras)
+
+    def reserve_tracks(self, song):
+        """
+        Picks tracks a reserve decodes ahead of promotion. A promoted reserve takes over whichever
+        track the dropped device held, which cannot be told in advance, and not every track fits in
+        the track cache. The most important tracks held by a device are prepared, where a dropout
+        is heard most. Promotion to any other track streams it, so output begins after one chunk.
+        :param song: Song being played.
+        :return: list of tracks, most important first.
+        """
+
+        held = self.device_list.get_held_tracks()
+        return [t for t in song.priority if t in held][:RESERVE_PREFETCH_TRACKS]
+
+    def mix_extras(self, song):
+        """
+        Gets unassigned tracks this device mixes into its own, see DeviceList.mix_assignment.
+        :param song: Song being played.
+        :return: tuple of (track name, weight), more important tracks weighted closer to 1.
         """
 
-        start_time_int = round(leader_started_playing * 1000) # get milliseconds
-        msg = create_message(ActionCodes.SONG_JOIN, start_time_int, self.address, song_folder_idx)
-        self.send(transceiver, msg, SINGLE_SEND_DURATION)
+        if not MIX_UNASSIGNED or self.track is None or self.track < 0:
+            return ()
+        rank = {t: i for i, t in enumerate(song.priority)}
+        lowest = max(len(song.priority) - 1, 1)
+        extras = self.device_list.mix_assignment(song.priority).get(self.track, [])
+        return tuple((song.track_names[t], round(1 - (1 - MIX_LOW_WEIGHT) * rank[t] / lowest, 3)) for t in extras)
 
-    def follower_receive_song_join(self):
+    def update_mix(self, playback):
         """
-        Follower syncing playback with leader after hearing song join request.
-        :return: playback info, leader start time, song identifier.
+        Moves playback onto the mix its track should carry now that devices joined or left,
+        once the mix is made in the background by prefetch. Streamed playback switches at a
+        chunk seam, playback in one piece restarts on the new mix at the same position.
+        Only affected devices do any work.
+        :param playback: song info.
         """
 
-        leader_start = self.received.follow_addr / 1000
+        if playback == None or not playback.is_playing() or playback.mix is None:
+            return
+        song = catalog.song(self.song_folder_idx)
+        if song is None or self.track is None or not 0 <= self.track < len(song.track_names):
+            return
+        track_name = song.track_names[self.track]
+        extras = self.mix_extras(song)
+        if playback.mix[0] != track_name or playback.mix == (track_name, extras):
+            return  # reassigned and restarting, or already right
+
+        if len(extras) == 0:
+            sound = decoded_track(song.path, track_name)
+        else:
+            sound = latest_mix.get((os.path.normpath(song.path), track_name, extras))
+        if sound is None:
+            if self.mixing is None or self.mixing.done():
+                self.mixing = prefetch_pool.submit(prefetch_mix, song.path, track_name, extras)
+            return  # checked again next cycle
+        print(f"Mixing {len(extras)} unassigned tracks into {track_name}")
+        playback.switch(sound, (track_name, extras))
+
+    def follower_receive_channel(self):
+        """
+        Follower records data channel assignment, its own or another follower's.
+        """
 
-        # get song from message
-        song_folders = sorted(os.listdir(AUDIO_PATH))
-        song_folder_idx = self.received.options
+        device = self.device_list.find_device(self.received.follow_addr)
+        if device is not None:
+            device.channel = self.received.options
+        if self.received.follow_addr == self.address:
+            self.channel = self.received.options
+            print(f"Answering check-ins on {DATA_FREQUENCIES_HZ[self.channel] / 1e6} MHz")
 
-        # is a reserve but will still have updated information
-        if self.track == None or self.track == -1:
-            return None, leader_start, song_folder_idx
+    def leader_adapt_rate(self, transceiver):
+        """
+        Leader steps symbol rate down when errors rise, and up when every link has
+        margin to spare, announcing the change before switching itself.
+        :param transceiver: cc1101 antenna.
+        """
 
-        song_path = os.path.join(AUDIO_PATH, song_folders[song_folder_idx])
+        frames = self.frames_heard + self.frame_errors
+        if not RATE_ADAPTATION or frames == 0:
+            return
+        self.link_error_rate += LINK_WEIGHT * (self.frame_errors / frames - self.link_error_rate)
+        self.frames_heard = 0
+        self.frame_errors = 0
+
+        rate_idx = self.rate_idx
+        if self.link_error_rate > RATE_ERROR_LIMIT and rate_idx > 0:
+            rate_idx -= 1
+        elif (self.link_error_rate < RATE_ERROR_LIMIT / 4
+                and rate_idx < len(SYMBOL_RATES_BAUD) - 1
+                and time.time() - self.rate_changed > RATE_HOLD_SEC):
+            followers = [d for d in self.device_list if d.get_address() != self.address]
+            # unmeasured links count as weak
+            if len(followers) > 0 and all(
+                    d.rssi is not None
+                    and d.rssi >= RATE_UP_RSSI_DBM + RATE_STEP_DB * rate_idx
+                    and d.lqi <= RATE_MAX_LQI for d in followers):
+                rate_idx += 1
+
+        if rate_idx == self.rate_idx:
+            return
+        print(f"Switching to {SYMBOL_RATES_BAUD[rate_idx]} baud, error rate {self.link_error_rate:.2f}")
+        msg = create_message(ActionCodes.RATE, 0, self.address, rate_idx)
+        self.send(transceiver, msg, SINGLE_SEND_DURATION)
+        self.set_rate(transceiver, rate_idx)
+        self.link_error_rate = 0  # start measuring the new rate from scratch
 
-        track_choices = sorted(os.listdir(song_path))
+    def set_rate(self, transceiver, rate_idx):
+        """
+        Switches this device to a new symbol rate.
+        :param transceiver: cc1101 antenna.
+        :param rate_idx: index into SYMBOL_RATES_BAUD.
+        """
 
-        if self.track > len(track_choices) - 1:
-            return None, leader_start, song_folder_idx
+        if rate_idx == self.rate_idx or rate_idx >= len(SYMBOL_RATES_BAUD):
+            return
+        self.rate_idx = rate_idx
+        self.rate_changed = time.time()
+        set_symbol_rate(transceiver, rate_idx)
 
-        track_name = track_choices[self.track]
-        track_path = os.path.join(song_path, track_name)
+    def follower_rate_fallback(self, transceiver):
+        """
+        Follower that hears nothing after a rate change drops to base rate, where
+        leader's attendance tells it the network's rate again.
+        :param transceiver: cc1101 antenna.
+        """
 
-        follower_start_time = time.time()
+        if self.rate_idx != 0 and time.time() - self.last_heard >= RATE_FALLBACK_SEC:
+            print("Lost leader at higher symbol rate, falling back")
+            self.set_rate(transceiver, 0)
+            self.last_heard = time.time()  # give attendance a full listen threshold before takeover
 
-        follower_start_timestamp = follower_start_time - leader_start
-        follower_start_timestamp = round(follower_start_timestamp * 1000) # get milliseconds
+    def leader_handle_message(self, transceiver, playback=None):
+        """
+        Leader handles messages heard while listening for something else.
+        :param transceiver: cc1101 antenna.
+        :param playback: current playback state.
+        """
 
-        sound = AudioSegment.from_file(track_path, format="mp3")
-        sound = sound.set_sample_width(2)
-        sound = sound - REDUCE_VOLUME
-        delay = (time.time() - follower_start_time) * 1000
-        sound = sound[follower_start_timestamp + delay:]
+        action = self.received.action
+        if action == ActionCodes.ATTENDANCE.value and self.received.leader_addr != self.address:
+            self.leader_heard_attendance(transceiver, playback)
+        elif action == ActionCodes.MERGE.value:
+            self.leader_receive_merge(transceiver, playback)
+        elif action == ActionCodes.REPORT.value:
+            self.leader_receive_report(transceiver, playback)
+        elif action == ActionCodes.REJOIN.value:
+            self.leader_receive_rejoin(transceiver, playback)
+        elif action == ActionCodes.SNAPSHOT_REQUEST.value:
+            self.leader_receive_snapshot_request(transceiver, playback)
+        elif action == ActionCodes.TIME_SYNC.value:
+            self.leader_receive_time_sync(transceiver)
+
+    def leader_heard_attendance(self, transceiver, playback):
+        """
+        Tiebreaker protocol if leader hears another leader, losing leader hands over its followers.
+        :param transceiver: cc1101 antenna.
+        :param playback: current playback state.
+        """
 
-        print(f"Playing {track_name}")
-        playback = _play_with_simpleaudio(sound)
-        self.device_list.update_num_tracks(len(track_choices))
+        other_addr = self.received.leader_addr
+        if self.address < other_addr:
+            print("becoming follower, other leader heard")
+            other_rate = self.received.options
+            # move own followers over first so they are not orphaned
+            set_symbol_rate(transceiver, self.rate_idx)
+            msg = create_message(ActionCodes.NEW_LEADER, other_addr, self.address, other_rate)
+            self.send(transceiver, msg, SINGLE_SEND_DURATION)
+            # winner is listening for attendance responses at base rate
+            set_symbol_rate(transceiver, 0)
+            self.leader_send_merge(transceiver, other_addr)
+            self.set_rate(transceiver, other_rate)
 
-        return playback, leader_start, song_folder_idx
+            # become follower
+            self.leader = False
+            self.leader_address = other_addr
+            self.standby_address = None
+            if playback != None:
+                playback.stop()
+            self.cancel_next()
+            self.change_display_role()
+        # else stay leader
 
-    def leader_send_list(self, transceiver):
+    def leader_send_merge(self, transceiver, other_addr):
         """
-        Leader sends updated list to all followers after new follower joins.
+        Losing leader sends its whole DeviceList to winning leader in one batch.
         :param transceiver: cc1101 antenna.
+        :param other_addr: identifier for winning leader.
         """
 
-        # iterate through devices whose responses have been heard
-        for i in range(len(self.device_list.devices)):
-            device = self.device_list.devices[i]
-            # create list message and send
-            msg = create_message(
-                ActionCodes.N_LIST,
-                device.get_address(),
-                self.address,
-                device.get_track(),
-            )
+        print(f"Merging {len(self.device_list)} devices into {hex(other_addr)}")
+        remaining = len(self.device_list)
+        for device in self.device_list:
+            remaining -= 1
+            # track in lower option bits (reserve sent as 0xFF), frames left in upper
+            options = (min(remaining, 0x7F) << 8) | (device.get_track() & 0xFF)
+            msg = create_message(ActionCodes.MERGE, device.get_address(), self.address, options)
             self.send(transceiver, msg, SINGLE_SEND_DURATION)
             plt.pause(SEND_LIST_DELAY)
 
-    def leader_send_song_start(self, transceiver):
+    def leader_receive_merge(self, transceiver, playback=None):
         """
-        Leader sends song start info to followers connected at song start time.
+        Winning leader collects losing leader's DeviceList, then sends one membership update.
         :param transceiver: cc1101 antenna.
-        :return: playback info, leader start time, song identifier.
+        :param playback: current playback state.
         """
 
-        # get start time
-        start_time = time.time() + SONG_START_OFFSET
-        start_time_int = round(start_time * 1000) # get milliseconds
+        other_addr = self.received.leader_addr
+        merged = {}
+        deadline = time.time()
+        while True:
+            if self.received.action == ActionCodes.MERGE.value and self.received.leader_addr == other_addr:
+                track = self.received.options & 0xFF
+                merged[self.received.follow_addr] = -1 if track == 0xFF else track
+                remaining = self.received.options >> 8
+                if remaining == 0:
+                    break
+                # losing leader repeats each entry for a send duration
+                deadline = time.time() + (remaining + 1) * (SINGLE_SEND_DURATION + SEND_LIST_DELAY)
+            if not looping or time.time() >= deadline:
+                break
+            if not self.receive(transceiver, deadline - time.time()):
+                break
 
-        # choose song randomly and get associated tracks
-        song_folders = sorted(os.listdir(AUDIO_PATH))
-        song_folder_idx = random.choice(range(len(song_folders)))
-        song_path = os.path.join(AUDIO_PATH, song_folders[song_folder_idx])
-        track_choices = sorted(os.listdir(song_path))
+        print(f"Merged {len(merged)} devices from {hex(other_addr)}")
+        new_devices = []
+        for address, track in merged.items():
+            if self.device_list.find_device(address) is not None:
+                continue
+            # keep track from other network, assignment settles clashes with this one
+            self.device_list.add_device(address, track)
+            new_devices.append(self.device_list.find_device(address))
+        self.leader_assign_tracks(playback)
 
-        if self.track == None or self.track == -1 or self.track > len(track_choices) - 1:
-            return None, start_time, song_folder_idx
+        # one membership update covers every merged device
+        self.leader_send_list(transceiver)
+        self.leader_send_succession(transceiver)
+        self.leader_send_channels(transceiver, new_devices)
+        if playback != None and playback.is_playing():
+            self.leader_send_song_join(transceiver, self.leader_started_playing, self.song_folder_idx)
 
-        track_name = track_choices[self.track]
-        track_path = os.path.join(song_path, track_name)
-        
-        # use follower_address part of message for sending start time in ms
-        sound = AudioSegment.from_file(track_path, format="mp3")
-        sound = sound.set_sample_width(2)
-        sound = sound - REDUCE_VOLUME
-        
-        msg = create_message(ActionCodes.SONG, start_time_int, self.address, song_folder_idx)
-        self.send(transceiver, msg, SINGLE_SEND_DURATION)
-        
-        while time.time() < start_time:  # wait until play time has come
-            _ = 2+2
-        
-        print(f"Playing {track_name}")
-        playback = _play_with_simpleaudio(sound)
+    def follower_receive_new_leader(self, transceiver, playback=None):
+        """
+        Follower moves to winning leader after its own leader lost a merge.
+        :param transceiver: cc1101 antenna.
+        :param playback: current playback state, restarted in sync with new leader.
+        """
 
-        self.device_list.update_num_tracks(len(track_choices))
-        
-        return playback, start_time, song_folder_idx
+        print(f"Leader merged into {hex(self.received.follow_addr)}, following it")
+        self.leader_address = self.received.follow_addr
+        self.clock = ClockSync()
+        self.set_rate(transceiver, self.received.options)
+        self.standby_address = None
+        self.lease_expiry = None
+        self.lease_until = None
+        self.pending_check_in = None
+        if playback != None:
+            playback.stop()
+        self.cancel_next()
+
+    def gossip_digest(self):
+        """
+        :return: membership digest to piggyback on transmissions in gossip mode, None otherwise.
+        """
 
-    def leader_send_delete(self, transceiver, address):
+        return self.device_list.digest() if GOSSIP_MODE else None
+
+    def follower_hear_gossip(self, transceiver):
         """
-        Leader informs connected followers to delete a disconnected device from DeviceList.
+        Follower records digests piggybacked on overheard messages, pulls list from an
+        up to date peer if its own list is out of date.
         :param transceiver: cc1101 antenna.
-        :param address: identifier for Device to drop.
         """
 
-        msg = create_message(ActionCodes.DELETE, address, self.address)
+        if not GOSSIP_MODE:
+            return
+
+        action = self.received.action
+        if action == ActionCodes.CHECK_IN.value:
+            self.leader_digest = self.received.options
+        elif action == ActionCodes.RESPONSE.value and self.received.follow_addr != self.address:
+            self.peer_digests[self.received.follow_addr] = self.received.options
+        elif action == ActionCodes.GOSSIP_PULL.value:
+            if self.received.follow_addr == self.address:
+                self.follower_gossip_respond(transceiver)
+            return
+
+        if self.gossip_pull is not None and time.time() - self.last_gossip_pull > GOSSIP_PULL_TIMEOUT:
+            self.gossip_pull = None  # peer did not answer in time
+
+        if (self.leader_digest is None or self.gossip_pull is not None
+                or self.device_list.digest() == self.leader_digest
+                or time.time() - self.last_gossip_pull < GOSSIP_PULL_INTERVAL):
+            return
+
+        peers = [address for address, digest in self.peer_digests.items()
+                 if digest == self.leader_digest and self.device_list.find_device(address) is not None]
+        if len(peers) == 0:
+            return
+
+        peer = random.choice(peers)  # spread pulls over up to date peers
+        print(f"Membership out of date, pulling list from {hex(peer)}")
+        msg = create_message(ActionCodes.GOSSIP_PULL, peer, self.leader_address, self.device_list.digest())
+        self.last_gossip_pull = time.time()
+        self.gossip_pull = set()
         self.send(transceiver, msg, SINGLE_SEND_DURATION)
 
-    def leader_check_in(self, transceiver):
+    def follower_gossip_respond(self, transceiver):
         """
-        Leader sends check-in message to each follower in its DeviceList.
+        Follower sends its list on behalf of leader to a peer that asked for it.
         :param transceiver: cc1101 antenna.
         """
 
-        for device in self.device_list:  # iterate through devices in list
-            address = device.get_address()
-            if address != self.address:  # make sure leader isn't checking in with itself
-                msg = create_message(ActionCodes.CHECK_IN, address, self.address)
-                self.send(transceiver, msg, SINGLE_SEND_DURATION)
+        if self.device_list.digest() != self.leader_digest:
+            return  # out of date itself, peer will ask someone else
 
-                responded = False
-                start_time = time.time()
-                while time.time() < start_time + WAIT_FOR_CHECK_IN_RESPONSE:
-                    if self.receive(transceiver, WAIT_FOR_CHECK_IN_RESPONSE):
-                        if self.received.follow_addr == address:
-                            responded = True
-                            break
-
-                if not responded:
-                    device.missed += 1  # increment device's missed check-in count
-                    if device.missed >= MAX_MISSED_CHECK_INS:  # improves robustness against noisy channel
-                        self.device_list.remove_device(
-                            address
-                        )  # delete from leader's copy
-                        self.leader_send_delete(transceiver, address)
-
-                        unused_tracks = self.device_list.unused_tracks()  # the unused track after deletion
-                        if device.track != -1:  # deleted a device that was playing a track
-                            for d in self.device_list:
-                                if d.track == -1:  # assign unused track to first reserve in DeviceList
-                                    d.track = unused_tracks[0]
-                                    break
-
-                plt.pause(CHECK_IN_DELAY)
-                
-    def leader_heard_attendance(self, playback):
+        print("Sending list to peer")
+        for device in self.device_list:
+            msg = create_message(
+                ActionCodes.N_LIST,
+                device.get_address(),
+                self.leader_address,
+                device.get_track(),
+            )
+            self.send(transceiver, msg, SINGLE_SEND_DURATION)
+            plt.pause(SEND_LIST_DELAY)
+
+    def finish_gossip_pull(self):
         """
-        Tiebreaker protocol if leader hears another leader.
-        :param playback: current playback state.
+        Ends pull once heard entries match leader's digest, dropping devices deleted meanwhile.
         """
 
-        other_addr = self.received.leader_addr
-        if self.address < other_addr:
-            print("becoming follower, other leader heard")
-            # become follower
-            self.leader = False
-            self.leader_addr = other_addr
-            if playback != None:
-                playback.stop()
-            self.change_display_role()
-        # else stay leader
+        self.gossip_pull.add(self.received.follow_addr)
+        if self.device_list.digest(self.gossip_pull) != self.leader_digest:
+            return
 
-    def follower_receive_list(self):
+        for device in list(self.device_list):
+            if device.get_address() not in self.gossip_pull:
+                print(f"Dropping {hex(device.get_address())}, missed its delete")
+                self.device_list.remove_device(device.get_address())
+        self.gossip_pull = None
+
+    def follower_receive_list(self, playback=None):
         """
         Follower updates its DeviceList after receiving list info from leader.
+        :param playback: song info, stopped if this device is moved to another track.
         """
 
         track = self.received.options
@@ -675,7 +3366,15 @@ class ThisDevice(Device):
             # check if track has changed for respective device
             if device.get_track() != track:
                 self.device_list.update_track(device.get_address(), track)
-        
+                if address == self.address:
+                    # reassigned by leader, leader's song join restarts playback on new track
+                    self.track = track
+                    if playback != None:
+                        playback.stop()
+                    self.change_display_role()
+
+        if self.gossip_pull is not None:
+            self.finish_gossip_pull()
 
     def follower_receive_song_start(self):
         """
@@ -684,47 +3383,25 @@ class ThisDevice(Device):
         """
 
         # get start time from message
-        start_time = self.received.follow_addr / 1000
+        start_time = self.leader_time_to_local(self.received.follow_addr)
 
         # get song from message
-        song_folders = sorted(os.listdir(AUDIO_PATH))
         song_folder_idx = self.received.options
 
         if self.track == None or self.track == -1:
             return None, start_time, song_folder_idx
 
-        song_path = os.path.join(AUDIO_PATH, song_folders[song_folder_idx])
-        track_choices = sorted(os.listdir(song_path))
-
-        if self.track > len(track_choices) - 1:
+        song = catalog.song(song_folder_idx)
+        if song is None or self.track > len(song.track_names) - 1:
             return None, start_time, song_folder_idx
 
-        track_name = track_choices[self.track]
-        track_path = os.path.join(song_path, track_name)
-
-        sound = AudioSegment.from_file(track_path, format="mp3")
-        sound = sound.set_sample_width(2)
-        sound = sound - REDUCE_VOLUME
-        self.device_list.update_num_tracks(len(track_choices))
-        
-        if time.time() > start_time:
-            follower_start_time = time.time()
-
-            follower_start_timestamp = follower_start_time - start_time
-            follower_start_timestamp = round(follower_start_timestamp * 1000)
+        track_name = song.track_names[self.track]
 
-            sound = AudioSegment.from_file(track_path, format="mp3")
-            sound = sound.set_sample_width(2)
-            sound = sound - REDUCE_VOLUME
-            delay = (time.time() - follower_start_time) * 1000
-            sound = sound[follower_start_timestamp + delay:]
-            
-        else:
-            while time.time() < start_time:
-                _ = 2+2
+        self.device_list.update_num_tracks(len(song.track_names))
 
+        # late followers skip ahead, streaming if track is not decoded yet
         print(f"Playing {track_name}")
-        playback = _play_with_simpleaudio(sound)
+        playback = play_track(song.path, track_name, start_time, self.mix_extras(song))
 
         return playback, start_time, song_folder_idx
 
@@ -737,17 +3414,23 @@ class ThisDevice(Device):
         response = create_message(
             ActionCodes.RESPONSE,
             self.address,
-            self.device_list.devices[0].get_address(),
+            self.leader_address,
+            self.gossip_digest(),
+            self.received.hops,  # relays carry response back as far as check-in came
         )
         print("Responding to check in!")
+        if MULTI_CHANNEL_MODE:
+            set_channel(transceiver, self.channel)
         self.send(transceiver, response, CHECK_IN_RESPONSE)
+        if MULTI_CHANNEL_MODE:
+            set_channel(transceiver, None)  # back to control channel for everything else
 
     def follower_receive_delete(self, addressToDelete, playback=None):
         """
         Follower updates list after receiving delete message, with error handling.
+        Leader follows up with any track reassignments.
         :param addressToDelete: identifier for device to delete.
         :param playback: song info.
-        :return: playback of deleted device, is assigned to promoted reserve.
         """
 
         if self.address == addressToDelete:  # error handling, improved robustness
@@ -758,17 +3441,7 @@ class ThisDevice(Device):
                 playback.stop()
             self.track = None
         self.device_list.remove_device(addressToDelete)
-
-        # all devices already have updated song information from attendance
-        unused_tracks = self.device_list.unused_tracks()  # the unused track after deletion
-        for device in self.device_list.devices:
-            if device.track == -1:  # detect first reserve, then break
-                if device.get_address() == self.address:  # this is the reserve to promote
-                    self.track = unused_tracks[0]
-                    device.track = unused_tracks[0]
-                    return self.promote_this_reserve(self.leader_started_playing, self.song_folder_idx)
-                device.track = unused_tracks[0]  # other followers update their device list too
-                break
+        self.deputy_failed.discard(addressToDelete)  # leader acted on deputy's report
 
     def promote_this_reserve(self, leader_start, song_folder_idx):
         """
@@ -778,52 +3451,45 @@ class ThisDevice(Device):
         :return: playback of deleted device, is assigned to promoted reserve.
         """
 
-        song_folders = sorted(os.listdir(AUDIO_PATH))
-        song_path = os.path.join(AUDIO_PATH, song_folders[song_folder_idx])
-        track_choices = sorted(os.listdir(song_path))
-        track_name = track_choices[self.track]
-        track_path = os.path.join(song_path, track_name)
+        song = catalog.song(song_folder_idx)
         self.change_display_role()
-
-        follower_start_time = time.time()
-        follower_start_timestamp = follower_start_time - leader_start
-        follower_start_timestamp = round(follower_start_timestamp * 1000)  # get milliseconds
-
-        sound = AudioSegment.from_file(track_path, format="mp3")
-        sound = sound.set_sample_width(2)
-        sound = sound - REDUCE_VOLUME
-        delay = (time.time() - follower_start_time) * 1000
-        sound = sound[follower_start_timestamp + delay:]
+        if song is None or self.track > len(song.track_names) - 1:
+            return None
+        track_name = song.track_names[self.track]
 
         print(f"Playing {track_name}")
-        playback = _play_with_simpleaudio(sound)
+        playback = play_track(song.path, track_name, leader_start, self.mix_extras(song))
         return playback
 
-    def handle_promotion(self):
+    def handle_promotion(self, new_leader=None):
         """
         Follower takes over as leader after leader disconnects, also promotes a reserve.
-        :return: newly assigned playback if ThisDevice is promoted reserve, True if promoted leader.
+        :param new_leader: identifier for standby leader, if one was designated.
+        :return: newly assigned playback if ThisDevice is promoted reserve, None otherwise.
         """
 
         # remove leader from device list
         self.device_list.remove_device(self.leader_address)
-        # get new leader from list based on track position
-        self.leader_address = self.device_list.get_highest_addr()
+        # standby has shadowed the leader, otherwise follow leader's succession list
+        if new_leader is not None and self.device_list.find_device(new_leader) is not None:
+            self.leader_address = new_leader
+        else:
+            self.leader_address = self.device_list.next_leader()
+        self.standby_address = None
+        self.lease_expiry = None
+        self.lease_until = None
+        self.pending_check_in = None
+        self.clock = ClockSync()
         # if new leader is this device's address, self.leader = True
         if self.leader_address == self.address:
             self.leader = True
             self.change_display_role()
         # all devices already have updated song information
-        unused_tracks = self.device_list.unused_tracks() # the unused track after deletion
-        for device in self.device_list.devices:
-            if device.track == -1:  # detect first reserve, then break
-                if device.get_address() == self.address:  # this is the reserve to promote
-                    self.track = unused_tracks[0]
-                    device.track = unused_tracks[0]
-                    return self.promote_this_reserve(self.leader_started_playing, self.song_folder_idx)
-                device.track = unused_tracks[0]  # other followers update their device list too
-                break
-        return self.leader
+        reserve = self.device_list.promote_reserve()
+        if reserve is not None and reserve.get_address() == self.address:  # this is the reserve to promote
+            self.track = reserve.get_track()
+            return self.promote_this_reserve(self.leader_started_playing, self.song_folder_idx)
+        return None
         # TODO: What happens if a reserve gets promoted to leader?
 
     def set_display(self):
@@ -879,7 +3545,7 @@ class ThisDevice(Device):
         plt.show()
 
 def create_message(
-    action: ActionCodes, follower_addr: int, leader_addr: int, options=None
+    action: ActionCodes, follower_addr: int, leader_addr: int, options=None, hops=0
 ):
     """
     Creates Message object containing all information relevant to transmit.
@@ -887,6 +3553,7 @@ def create_message(
     :param follower_addr: identifier for intended follower.
     :param leader_addr: identifier for intended leader.
     :param options: int to send extra information.
+    :param hops: relay hop count.
     :return: Message object.
     """
 
@@ -899,9 +3566,335 @@ def create_message(
             msg |= ((1 << MessageBits.OPTION_LEN.value) - 1) << MessageBits.OPTION_SHIFT.value
         else:
             msg |= options << MessageBits.OPTION_SHIFT.value
+    msg |= hops << MessageBits.HOP_SHIFT.value
     return msg
 
 
+def set_channel(transceiver, channel):
+    """
+    Tunes transceiver to a data channel or back to the control channel.
+    :param transceiver: cc1101 antenna.
+    :param channel: index into DATA_FREQUENCIES_HZ, None for control channel.
+    """
+
+    if channel is None:
+        transceiver.set_base_frequency_hertz(CONTROL_FREQUENCY_HZ)
+    else:
+        transceiver.set_base_frequency_hertz(DATA_FREQUENCIES_HZ[channel])
+
+
+def set_symbol_rate(transceiver, rate_idx):
+    """
+    Sets transceiver's symbol rate.
+    :param transceiver: cc1101 antenna.
+    :param rate_idx: index into SYMBOL_RATES_BAUD.
+    """
+
+    transceiver.set_symbol_rate_baud(SYMBOL_RATES_BAUD[rate_idx])
+
+
+def read_priority(song_path):
+    """
+    Reads a song's track order from the priority file in its folder.
+    :param song_path: folder of song.
+    :return: track file names, most important first, empty if song has no priority file.
+    """
+
+    try:
+        with open(os.path.join(song_path, PRIORITY_FILE)) as f:
+            return [line.strip() for line in f if line.strip() != ""]
+    except OSError:
+        return []
+
+
+def track_priority(track_names, ranked=()):
+    """
+    Orders a song's tracks by musical importance, from its priority file, else keywords in file names.
+    :param track_names: sorted file names of song's tracks.
+    :param ranked: track file names from song's priority file, most important first.
+    :return: track indices, most important first, unmatched tracks last in file order.
+    """
+
+    def rank(i):
+        name = track_names[i]
+        if name in ranked:
+            return -1, ranked.index(name)
+        for k, keyword in enumerate(STEM_PRIORITY_KEYWORDS):
+            if keyword in name.lower():
+                return k, i
+        return len(STEM_PRIORITY_KEYWORDS), i
+
+    return sorted(range(len(track_names)), key=rank)
+
+
+def load_track(song_path, track_name):
+    """
+    Gets track decoded at playback volume, reusing earlier decodes.
+    :param song_path: folder of song.
+    :param track_name: file name of track in song folder.
+    :return: AudioSegment ready to play.
+    """
+
+    pack = open_pack(song_path)
+    if pack is not None and track_name in pack.tracks:
+        return pack.track(track_name)
+    return track_cache.get(song_path, track_name, REDUCE_VOLUME)
+
+
+def play_track(song_path, track_name, started, extras=()):
+    """
+    Starts playing track in step with a playback that started earlier or starts soon, e.g. the leader's.
+    A late joiner whose track is not decoded yet streams it, so output begins after decoding
+    a chunk, not the whole track, and hands off to the decoded track once it is ready. On-time starts decode first and play in one piece, with
+    unassigned tracks mixed in if the mix is ready by start time.
+    With drift correction, decoded tracks are played in chunks too.
+    :param song_path: folder of song.
+    :param track_name: file name of track in song folder.
+    :param started: local time track started or starts at.
+    :param extras: (track name, weight) of unassigned tracks to mix in, once they are decoded.
+    :return: TrackPlayback or StreamPlayback.
+    """
+
+    mix = (track_name, tuple(extras))
+    key = (os.path.normpath(song_path), track_name, tuple(extras))
+    if len(extras) > 0 and key not in latest_mix and time.time() < started:
+        # mixed in the background while an on-time start waits anyway, starts unmixed if it is not ready
+        wait([prefetch_pool.submit(prefetch_mix, song_path, track_name, extras)], max(0, started - time.time()))
+    sound = latest_mix.get(key)
+    if sound is None:
+        sound = decoded_track(song_path, track_name)
+        mix = (track_name, ())  # extras join at a later seam, see ThisDevice.update_mix
+    if sound is None and time.time() > started:
+        prefetch_track(song_path, track_name)  # stream hands off to it once decoded
+        try:
+            return StreamPlayback(os.path.join(song_path, track_name), started, REDUCE_VOLUME, mix=mix)
+        except OSError as e:
+            print(f"Could not stream {track_name}, decoding it whole: {e}")
+    if sound is None:
+        sound = load_track(song_path, track_name)
+    if DRIFT_CORRECTION:
+        # played in chunks straight from decoded samples, so beacons can correct it at each seam
+        try:
+            return StreamPlayback(os.path.join(song_path, track_name), started, REDUCE_VOLUME, sound, mix)
+        except OSError:
+            pass  # leader is already past end of track
+
+    wait_until(started)
+    return TrackPlayback(sound, started, mix)  # skips what was played while loading
+
+
+def decoded_track(song_path, track_name):
+    """
+    Gets track at playback volume if it needs no decoding.
+    :param song_path: folder of song.
+    :param track_name: file name of track in song folder.
+    :return: AudioSegment from song's pack or track cache, None if track is not decoded yet.
+    """
+
+    pack = open_pack(song_path)
+    if pack is not None and track_name in pack.tracks:
+        return pack.track(track_name)
+    return track_cache.peek(song_path, track_name, REDUCE_VOLUME)
+
+
+def mix_track(song_path, track_name, extras):
+    """
+    Gets track with unassigned tracks mixed in. Only the latest mix is kept, a device carries one
+    mix at a time and mixes are not worth the cache space decoded tracks need.
+    :param song_path: folder of song.
+    :param track_name: file name of track in song folder.
+    :param extras: (track name, weight) of tracks to mix in.
+    :return: mixed AudioSegment, None if there is nothing to mix or a track is not decoded yet.
+    """
+
+    if len(extras) == 0:
+        return None
+    key = (os.path.normpath(song_path), track_name, tuple(extras))
+    mixed = latest_mix.get(key)
+    if mixed is not None:
+        return mixed
+
+    sounds = [decoded_track(song_path, name) for name in [track_name] + [name for name, _ in extras]]
+    if None in sounds:
+        return None
+    mixed = mix_stems(sounds, [1] + [weight for _, weight in extras])
+    latest_mix.clear()
+    latest_mix[key] = mixed
+    return mixed
+
+
+def prefetch_mix(song_path, track_name, extras):
+    """
+    Mixes unassigned tracks into a track once they are decoded, run by background workers.
+    :param song_path: folder of song.
+    :param track_name: file name of track in song folder.
+    :param extras: (track name, weight) of tracks to mix in.
+    """
+
+    for name in [track_name] + [name for name, _ in extras]:
+        if decoded_track(song_path, name) is None:
+            load_track(song_path, name)  # waits for a decode already in progress
+    mix_track(song_path, track_name, extras)
+
+
+def mix_stems(sounds, weights):
+    """
+    Sums weighted tracks in one vectorized pass each, scaled down only if the sum would clip.
+    :param sounds: AudioSegments at playback volume, first one sets the format.
+    :param weights: weight of each track.
+    :return: AudioSegment over read-only mixed samples, as long as the longest track.
+    """
+
+    first = sounds[0]
+    sounds = [s if (s.frame_rate, s.channels, s.sample_width) == (first.frame_rate, first.channels, 2)
+              else s.set_sample_width(2).set_frame_rate(first.frame_rate).set_channels(first.channels)
+              for s in sounds]
+    total = np.zeros(max(len(s.raw_data) for s in sounds) // 2, dtype=np.float32)
+    for sound, weight in zip(sounds, weights):
+        samples = np.frombuffer(sound.raw_data, dtype=np.int16)
+        total[:len(samples)] += samples * np.float32(weight)
+
+    peak = np.abs(total).max() if len(total) > 0 else 0
+    if peak > 32767:
+        total *= 32767 / peak
+    mixed = total.astype(np.int16)
+    mixed.flags.writeable = False
+    return track_view(AudioSegment(memoryview(mixed).cast("B"), sample_width=2,
+                                   frame_rate=first.frame_rate, channels=first.channels), 0)
+
+
+def wait_until(start_time):
+    """
+    Waits for a start time, sleeping most of the way and spinning only for the last moment.
+    Counted on the monotonic clock, so the wall clock stepping meanwhile does not move the start.
+    :param start_time: local time to start at.
+    :return: seconds between start time and return, how late the caller starts.
+    """
+
+    deadline = time.monotonic() + (start_time - time.time())
+    if deadline <= time.monotonic():
+        return time.monotonic() - deadline  # already late, caller skips ahead
+
+    wait_for(deadline)
+    late = time.monotonic() - deadline
+    print(f"Started {late * 1e6:.0f} us after scheduled time")
+    return late
+
+
+def wait_for(deadline):
+    """
+    Sleeps until shortly before a monotonic deadline, then spins up to it.
+    :param deadline: time.monotonic() value to wait for.
+    """
+
+    remaining = deadline - time.monotonic()
+    if remaining > START_SPIN_SEC:
+        time.sleep(remaining - START_SPIN_SEC)
+    while time.monotonic() < deadline:
+        pass
+
+
+def track_view(sound, start_ms):
+    """
+    Gets the rest of a track from an offset, sharing the track's samples instead of copying them.
+    :param sound: AudioSegment to play from.
+    :param start_ms: offset into track.
+    :return: AudioSegment over a memoryview of sound's samples, safe to slice like any other.
+    """
+
+    data = memoryview(sound.raw_data).cast("B")
+    skip = min(max(0, round(start_ms * sound.frame_rate / 1000)) * sound.frame_width, len(data))
+    # end where pydub's millisecond length ends, slicing past the data would pad it with silence,
+    # which a memoryview cannot be extended with
+    frames = (len(data) - skip) // sound.frame_width
+    frames = int(int(frames * 1000 / sound.frame_rate) * (sound.frame_rate / 1000.0))
+    return AudioSegment(data[skip:skip + frames * sound.frame_width], sample_width=sound.sample_width,
+                        frame_rate=sound.frame_rate, channels=sound.channels)
+
+
+def apply_gain(data, gain):
+    """
+    Turns 16 bit samples down in one vectorized pass, without a full-size float copy.
+    :param data: 16 bit samples.
+    :param gain: dB to turn samples down by.
+    :return: read-only memoryview of turned down samples.
+    """
+
+    samples = np.frombuffer(data, dtype=np.int16)
+    turned_down = np.empty_like(samples)
+    np.multiply(samples, 10 ** (-gain / 20), out=turned_down, casting="unsafe")
+    turned_down.flags.writeable = False
+    return memoryview(turned_down).cast("B")
+
+
+def stretch(data, channels, frames):
+    """
+    Resamples a chunk to a slightly different length by linear interpolation.
+    :param data: 16 bit samples.
+    :param channels: number of interleaved channels.
+    :param frames: number of frames to resample to.
+    :return: memoryview of resampled samples.
+    """
+
+    samples = np.frombuffer(data, dtype=np.int16).reshape(-1, channels)
+    positions = np.linspace(0, len(samples) - 1, frames)
+    stretched = np.empty((frames, channels), dtype=np.int16)
+    for channel in range(channels):
+        stretched[:, channel] = np.interp(positions, np.arange(len(samples)), samples[:, channel])
+    return memoryview(stretched).cast("B")
+
+
+def prefetch_track(song_path, track_name):
+    """
+    Queues track to be decoded by background workers, unless it needs no decoding.
+    :param song_path: folder of song.
+    :param track_name: file name of track in song folder.
+    """
+
+    pack = open_pack(song_path)
+    if pack is not None and track_name in pack.tracks:
+        return  # mapped packs play without decoding
+    if track_cache.contains(song_path, track_name, REDUCE_VOLUME):
+        return
+    print(f"Prefetching {track_name}")
+    prefetch_pool.submit(load_track, song_path, track_name)
+
+
+def open_pack(song_path):
+    """
+    Gets compiled pack of a song, mapped once and kept open.
+    :param song_path: folder of song.
+    :return: TrackPack, None if song was not compiled, was changed since, or used another volume.
+    """
+
+    song = os.path.basename(os.path.normpath(song_path))
+    if song in track_packs:
+        return track_packs[song]
+
+    pack = None
+    pack_path = os.path.join(PACK_PATH, song + ".pack")
+    if os.path.exists(pack_path) and os.path.getmtime(pack_path) >= os.path.getmtime(song_path):
+        try:
+            pack = TrackPack(pack_path)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Could not open {pack_path}: {e}")
+        if pack is not None and pack.gain != REDUCE_VOLUME:
+            pack = None
+    track_packs[song] = pack
+    return pack
+
+
+def entry_checksum(address, track):
+    """
+    Checksum of one membership entry, summed into order-independent digests.
+    :param address: identifier for device.
+    :param track: track assigned to device.
+    :return: crc32 of entry.
+    """
+
+    return zlib.crc32(f"{address}:{track}".encode())
+
+
 def remove_length_byte(msg: int):
     """
     Helper for message bit masking.
@@ -947,9 +3940,10 @@ def main():
     with cc1101.CC1101() as transceiver:
         # create device object
         device = ThisDevice(getnode())
+        catalog.load()  # listed before radio starts, not while handling a message
         device.setup(transceiver)
         
-        playback = None  # instance of PlayObject
+        playback = None  # instance of TrackPlayback or StreamPlayback
         leader_started_playing = None  # time that leader started playing their track
         song_folder_idx = None  # randomly chosen song folder
 
@@ -963,6 +3957,7 @@ def main():
         # global looping
         while True:
             print(device.device_list)
+            device.save_state()
 
             # break out of loop when stop button is pressed
             if not looping:
@@ -972,19 +3967,30 @@ def main():
 
             if device.get_leader():  # Leader loop
                 # check to see if song is playing
-                if playback == None:
+                if device.next_ready:
+                    # next song started on time in the background, carry on with it
+                    if playback != None and playback is not device.next_playback:
+                        playback.stop()
+                    playback, leader_started_playing, song_folder_idx = device.leader_start_next_song(transceiver)
+                elif device.next_song is not None:
+                    pass  # current song plays out, next one is already queued
+                elif playback == None:
                     playback, leader_started_playing, song_folder_idx = device.leader_send_song_start(transceiver)
                 elif not playback.is_playing():
                     # send song start message if not playing
                     playback, leader_started_playing, song_folder_idx = device.leader_send_song_start(transceiver)
-                    
+                device.leader_started_playing = leader_started_playing
+                device.song_folder_idx = song_folder_idx
+
                 if not looping:
                     if playback != None:
                         playback.stop()
                     break
 
                 # send check in messages and wait for responses
-                device.leader_check_in(transceiver)
+                device.leader_check_in(transceiver, playback)
+                if device.get_leader():
+                    device.leader_adapt_rate(transceiver)
                 # send delete message if response not heard from device after threshold (handled in leader_check_in)
                 
                 if not looping:
@@ -992,8 +3998,9 @@ def main():
                         playback.stop()
                     break
 
-                # send attendance message
-                device.leader_send_attendance(transceiver, playback, leader_started_playing, song_folder_idx)
+                # send attendance message, unless leader was merged into another network
+                if device.get_leader():
+                    device.leader_send_attendance(transceiver, playback, leader_started_playing, song_folder_idx)
                 # listen for new followers
                 # send revised list if new followers are heard (handled in leader_send_attendance)
                 
@@ -1010,22 +4017,48 @@ def main():
                         playback.stop()
                     break
 
-                if device.receive(transceiver, FOLLOWER_LISTEN_THRESHOLD):
+                if device.next_ready:
+                    # next song started on time in the background, carry on with it
+                    if playback != None and playback is not device.next_playback:
+                        playback.stop()
+                    playback, leader_started_playing, song_folder_idx = device.take_next_song()
+
+                if device.lease_expired():
+                    print("--------Leader lease expired, standby taking over--------")
+                    reserve_promotion = device.handle_promotion(device.address)
+                    if reserve_promotion is not None:
+                        playback = reserve_promotion
+                    continue
+
+                if device.receive(transceiver, device.follower_listen_timeout()):
                     action = device.received.action
 
+                    if (device.standby_address is not None
+                            and device.received.leader_addr == device.standby_address):
+                        # standby already took over, follow it without waiting out the silence
+                        print("Standby heard as leader, following it")
+                        reserve_promotion = device.handle_promotion(device.standby_address)
+                        if reserve_promotion is not None:
+                            playback = reserve_promotion
+
                     if device.received.leader_addr != device.leader_address:
                         # device.leader_address = max(device.received.leader_addr, device.leader_address)
                         continue
 
+                    if device.follower_relay(transceiver):
+                        continue
+
+                    device.standby_observe()
+                    device.deputy_observe()
+                    device.follower_hear_gossip(transceiver)
+
                     # messages for all followers
                     if action == ActionCodes.DELETE.value:
-                        reserve_promotion = device.follower_receive_delete(device.received.follow_addr, playback)
-                        if reserve_promotion is not None:
-                            playback = reserve_promotion
+                        device.follower_receive_delete(device.received.follow_addr, playback)
                         
                     elif action == ActionCodes.N_LIST.value:
                         print("Updating list on follower side***")
-                        device.follower_receive_list()
+                        device.follower_receive_list(playback)
                         
                     elif (
                         action == ActionCodes.ATTENDANCE.value
@@ -1039,8 +4072,54 @@ def main():
                         device.leader_started_playing = leader_started_playing
                         device.song_folder_idx = song_folder_idx
 
+                    elif action == ActionCodes.LEASE.value:
+                        device.follower_receive_lease()
+
+                    elif action == ActionCodes.SUCCESSION.value:
+                        device.follower_receive_succession()
+
+                    elif action == ActionCodes.NEW_LEADER.value:
+                        device.follower_receive_new_leader(transceiver, playback)
+
+                    elif action == ActionCodes.CHANNEL.value:
+                        device.follower_receive_channel()
+
+                    elif action == ActionCodes.DEPUTY.value:
+                        device.follower_receive_deputy()
+
+                    elif action == ActionCodes.RATE.value:
+                        device.set_rate(transceiver, device.received.options)
+
+                    elif action == ActionCodes.TIME_SYNC_REPLY.value:
+                        device.follower_receive_time_sync()
+
+                    elif action == ActionCodes.NEXT_SONG.value:
+                        device.follower_receive_next_song()
+
+                    elif action == ActionCodes.BEACON.value:
+                        device.follower_receive_beacon(playback)
+                        leader_started_playing = device.leader_started_playing
+
+                    elif action in (ActionCodes.SNAPSHOT.value, ActionCodes.SNAPSHOT_ENTRY.value,
+                                    ActionCodes.SNAPSHOT_END.value):
+                        snapshot_playback = device.follower_receive_snapshot(playback)
+                        if snapshot_playback is not None:
+                            playback = snapshot_playback
+                        if device.song_folder_idx is not None:
+                            leader_started_playing = device.leader_started_playing
+                            song_folder_idx = device.song_folder_idx
+
+                    elif action == ActionCodes.ATTENDANCE.value:
+                        # only heard at base rate after falling back, rejoin network's rate
+                        device.set_rate(transceiver, device.received.options)
+
                     elif action == ActionCodes.SONG_JOIN.value:
                         if ((playback != None) and (playback.is_playing())) or device.track == None:
+                            # keep leader's playback timing for a possible takeover
+                            leader_started_playing = device.leader_time_to_local(device.received.follow_addr)
+                            song_folder_idx = device.received.options
+                            device.leader_started_playing = leader_started_playing
+                            device.song_folder_idx = song_folder_idx
                             continue
                         playback, leader_started_playing, song_folder_idx = device.follower_receive_song_join()
                         device.leader_started_playing = leader_started_playing
@@ -1050,6 +4129,13 @@ def main():
                         plt.pause(CHECK_IN_DELAY)
                         device.follower_respond_check_in(transceiver)
                         
+                    device.follower_tick(transceiver, playback)
+
+                elif time.time() - device.last_heard < device.follower_silence_threshold():
+                    # woke up early for deputy check-ins or relaying, leader is not silent yet
+                    device.follower_tick(transceiver, playback)
+                    device.follower_rate_fallback(transceiver)
+
                 else:  # no message heard, start takeover protocol
                     print("Is there anybody out there?")
                     if not looping:
@@ -1061,11 +4147,16 @@ def main():
                         break
 
                     # Leader dropped out
-                    if device.handle_promotion():
+                    reserve_promotion = device.handle_promotion(device.standby_address)
+                    if reserve_promotion is not None:
+                        playback = reserve_promotion
+                    if device.get_leader():
                         print("--------Taking over as new leader--------")
                     else:
                         print("Staying as follower under a new leader")
 
+    device.cancel_next()
+
 
 if __name__ == "__main__":
 
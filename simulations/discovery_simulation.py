@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import random
+
+# mirrors main_protocol.py
+WAIT_FOR_ATTENDANCE_SEC = 2
+PROBE_JITTER_SEC = 0.6
+CLAIM_ROUND_SEC = 2
+RAND_LOWER = 0.05
+MESSAGE_LEN = 128  # action + follow + leader + option + hop bits, plus preamble/sync
+
+# baud is bits per second, message is # of bits
+def calc_transmit_time(message_len, baud_rate):
+    t = round((message_len / baud_rate), 5)
+    return t
+
+# probe start times for one device probing from start for duration
+def pick_probe_times(start, duration):
+    end = start + duration
+    t = start + random.uniform(0, PROBE_JITTER_SEC)
+    probes = []
+    while t < end:
+        probes.append(t)
+        # single frame, then jittered gap spent listening
+        t += random.uniform(RAND_LOWER, PROBE_JITTER_SEC)
+    return probes
+
+# true if some probe of sender reaches listener uncorrupted between start and end
+# listener's own probes count too, it cannot hear while transmitting
+def heard(sender, listener, probes, start, end, transmit_time):
+    for t in probes[sender]:
+        if not (start <= t <= end):
+            continue
+        collided = False
+        for other in probes:
+            if other == sender:
+                continue
+            for u in probes[other]:
+                if abs(u - t) < transmit_time:
+                    collided = True
+                    break
+            if collided:
+                break
+        if not collided:
+            return True
+    return False
+
+# time listener first hears a probe from a higher address between start and end, None if it never does
+def first_heard(listener, probes, start, end, transmit_time, above):
+    times = []
+    for s in probes:
+        if s <= above:
+            continue
+        for t in probes[s]:
+            if start <= t <= end and not any(abs(u - t) < transmit_time
+                                             for other in probes if other != s for u in probes[other]):
+                times.append(t)
+                break
+    return min(times, default=None)
+
+# run one boot storm, return True if all devices agree on a single winner
+def run_test(ndevices, baud_rate, boot_spread, claim=True):
+    transmit_time = calc_transmit_time(MESSAGE_LEN, baud_rate)
+    boots = {i: random.uniform(0, boot_spread) for i in range(ndevices)}
+    probes = {i: pick_probe_times(boots[i], WAIT_FOR_ATTENDANCE_SEC) for i in range(ndevices)}
+
+    # randomized phase, device addresses are random so device numbers double as addresses
+    claimants = []
+    for listener in range(ndevices):
+        end = boots[listener] + WAIT_FOR_ATTENDANCE_SEC
+        heard_from = {s for s in range(ndevices) if s != listener
+                      and heard(s, listener, probes, boots[listener], end, transmit_time)}
+        if max(heard_from | {listener}) == listener:
+            claimants.append(listener)
+    if not claim:
+        return len(claimants) == 1
+
+    # claim round, devices that think they won keep probing and stop once they hear a higher claim
+    starts = {c: boots[c] + WAIT_FOR_ATTENDANCE_SEC for c in claimants}
+    claims = {c: pick_probe_times(starts[c], CLAIM_ROUND_SEC) for c in claimants}
+    yielded = {}
+    for i in range(ndevices):
+        # who yields when depends on whose probes are still on air, repeat until settled
+        changed = False
+        on_air = {i: probes[i] + [t for t in claims.get(i, []) if t < yielded.get(i, float("inf"))]
+                  for i in range(ndevices)}
+        for c in claimants:
+            when = first_heard(c, on_air, starts[c], starts[c] + CLAIM_ROUND_SEC, transmit_time, above=c)
+            if when != yielded.get(c):
+                changed = True
+                if when is None:
+                    del yielded[c]
+                else:
+                    yielded[c] = when
+        if not changed:
+            break
+    leaders = [c for c in claimants if c not in yielded]
+    return len(leaders) == 1
+
+# run trials and return percentage converging on a single leader
+def run_trials(ndevices, baud_rate, boot_spread, claim=True, trials=200):
+    converged = 0
+    for i in range(trials):
+        if run_test(ndevices, baud_rate, boot_spread, claim):
+            converged += 1
+    return converged / trials * 100
+
+# Devices booting within boot_spread of each other, all within one discovery window.
+# Convergence time is bounded by the discovery window, the claim round and the winner's attendance.
+print(f"Discovery window {WAIT_FOR_ATTENDANCE_SEC}s, claim round {CLAIM_ROUND_SEC}s, bounded convergence "
+      f"~{2 * WAIT_FOR_ATTENDANCE_SEC + CLAIM_ROUND_SEC}s after last boot")
+for baud in (4800, 38400):
+    print(f"Parameters: {MESSAGE_LEN}bits, {baud / 1000}kbaud, boots within 0.5s")
+    print("   Chance of single leader, randomized phase only / with claim round...")
+    for n in (3, 5, 10, 20):
+        print(f'       w/ {n} devices: {run_trials(n, baud, 0.5, False):.1f}% / {run_trials(n, baud, 0.5):.1f}%')
+    print()
@@ -29,9 +29,9 @@ class MessageBits(Enum):
     # option bits are most significant
     # 9223372036854775807 is max 48 bit integer
     # 65535 is max 16 bit integer
-    ACTION_LEN = 4
+    ACTION_LEN = 8
     ACTION_SHIFT = 0
-    ACTION_MASK = 0xF << ACTION_SHIFT
+    ACTION_MASK = 0xFF << ACTION_SHIFT
     FOLLOW_ADDR_LEN = 48
     FOLLOW_ADDR_SHIFT = ACTION_SHIFT + ACTION_LEN
     FOLLOW_ADDR_MASK = 0xFFFFFFFFFFFF << FOLLOW_ADDR_SHIFT
@@ -0,0 +1,36 @@
+import os
+import sys
+import random
+import tempfile
+import numpy as np
+
+# run from repo root: python testing/pack_test.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main_protocol as mp
+
+# tracks of lengths that are not whole milliseconds, in a few formats
+tracks = {"odd.mp3": (44100, 2, 44100 * 3 + 17), "mono.mp3": (22050, 1, 22050 + 5), "hi.mp3": (48000, 2, 48000 * 2 + 1)}
+
+# write a pack by hand, pydub cannot decode MP3s without ffmpeg
+folder = tempfile.mkdtemp()
+for name, (frame_rate, channels, frames) in tracks.items():
+    path = os.path.join(folder, name + ".pack")
+    samples = np.arange(frames * channels, dtype=np.int16).tobytes()
+    # one format per pack, so each track gets its own pack
+    offset = mp.PACK_HEADER.size + mp.PACK_ENTRY.size
+    with open(path, "wb") as f:
+        f.write(mp.PACK_HEADER.pack(mp.PACK_MAGIC, mp.PACK_VERSION, 1, frame_rate, channels, 2, mp.REDUCE_VOLUME))
+        f.write(mp.PACK_ENTRY.pack(name.encode(), offset, len(samples)))
+        f.write(samples)
+    pack = mp.TrackPack(path)
+
+    # slice at odd offsets, like a late join does
+    for i in range(500):
+        start_ms = random.uniform(0, len(pack.track(name)) + 5)
+        sound = pack.track(name)[start_ms:]
+        sound = pack.track(name, random.uniform(0, 500))[start_ms:start_ms + random.uniform(0, 2000)]
+        sound = mp.track_view(pack.track(name), start_ms)[random.randint(0, 20):]
+    sound = pack.track(name)
+    print(f"{name}: {len(sound)} ms, {len(sound.raw_data) // sound.frame_width} of {frames} frames, slicing ok")
+
+    del pack, sound  # map stays open while slices of it exist
@@ -0,0 +1,33 @@
+import os
+import sys
+import shutil
+import tempfile
+
+# run from repo root: python testing/priority_test.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main_protocol as mp
+
+# every bundled song lists all of its tracks, and only its tracks, in its priority file
+catalog = mp.SongCatalog(mp.AUDIO_PATH)
+catalog.load()
+for song in catalog.songs:
+    ranked = mp.read_priority(song.path)
+    assert mp.PRIORITY_FILE not in song.track_names, song.name
+    assert sorted(ranked) == song.track_names, f"{song.name}: {ranked} does not match {song.track_names}"
+    assert [song.track_names[t] for t in song.priority] == ranked, song.name
+    print(f"{song.name}: {', '.join(ranked)}")
+
+# without a priority file, keywords then file order
+folder = tempfile.mkdtemp()
+for name in ["a.mp3", "bass.mp3", "c.mp3", "lead_vocal.mp3"]:
+    open(os.path.join(folder, name), "wb").close()
+song = mp.Song(0, folder)
+assert [song.track_names[t] for t in song.priority] == ["lead_vocal.mp3", "bass.mp3", "a.mp3", "c.mp3"], song.priority
+
+# a partial priority file goes first, the rest fall back, unknown names are ignored
+with open(os.path.join(folder, mp.PRIORITY_FILE), "w") as f:
+    f.write("c.mp3\n\nmissing.mp3\na.mp3\n")
+song = mp.Song(0, folder)
+assert [song.track_names[t] for t in song.priority] == ["c.mp3", "a.mp3", "lead_vocal.mp3", "bass.mp3"], song.priority
+shutil.rmtree(folder)
+print("fallback ok")